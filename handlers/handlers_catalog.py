@@ -1,6 +1,3 @@
-# --- Стандартные библиотеки ---
-import asyncio
-
 # --- Сторонние библиотеки ---
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
@@ -9,14 +6,18 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.exceptions import TelegramBadRequest
 
 # --- Внутренние модули ---
-from services.config import get_target_display_local, PURCHASE_COOLDOWN
+from services.config import get_target_display_local
 from services.menu import update_menu
-from services.gifts_bot import get_filtered_gifts
-from services.buy_bot import buy_gift
-from services.buy_userbot import buy_gift_userbot
+from services.gifts_bot import get_catalog_snapshot
+from services.catalog import remember_snapshot, find_snapshot
+from services.buy_bot import buy_gifts_batch
+from services.buy_userbot import buy_gifts_userbot_batch
 from services.balance import refresh_balance
+from services.userbot import is_userbot_active
+from services.orders import submit_order, purchase_result_text
 
 wizard_router = Router()
+_sharded = False  # Юзерботы владельцев работают в процессах-воркерах (WORKER_SHARDING=1)
 
 class CatalogFSM(StatesGroup):
     """
@@ -64,17 +65,11 @@ async def catalog(call: CallbackQuery, state: FSMContext):
     """
     Обработка открытия каталога. Получает список подарков и формирует сообщение с клавиатурой.
     """
-    gifts = await get_filtered_gifts(
-        bot=call.bot,
-        min_price=0,
-        max_price=1000000,
-        min_supply=0,
-        max_supply=100000000,
-        unlimited = True
-    )
+    snapshot = await get_catalog_snapshot()
+    gifts = [gift.as_dict() for gift in snapshot.select(0, 1000000, 0, 100000000, unlimited=True)]
 
-    # Сохраняем текущий каталог в FSM — нужен для последующих шагов
-    await state.update_data(gifts_catalog=gifts)
+    # В FSM сохраняем только id снимка каталога — сам снимок общий для всех пользователей
+    await state.update_data(catalog_snapshot_id=remember_snapshot(snapshot))
 
     gifts_limited = [g for g in gifts if g['supply'] != None]
     gifts_unlimited = [g for g in gifts if g['supply'] == None]
@@ -113,12 +108,13 @@ async def on_gift_selected(call: CallbackQuery, state: FSMContext):
     """
     gift_id = call.data.split("_")[-1]
     data = await state.get_data()
-    gifts = data.get("gifts_catalog", [])
-    if not gifts:
+    # Снимок мог быть вытеснен из реестра или потерян при перезапуске — ищем подарок в текущем каталоге
+    snapshot = find_snapshot(data.get("catalog_snapshot_id")) or await get_catalog_snapshot()
+    gift = next((g.as_dict() for g in snapshot if str(g.id) == gift_id), None)
+    if not gift:
         await call.answer("🚫 Каталог устарел. Откройте заново.", show_alert=True)
         await safe_edit_text(call.message, "🚫 Каталог устарел. Откройте заново.", reply_markup=None)
         return
-    gift = next((g for g in gifts if str(g['id']) == gift_id), None)
 
     gift_display = f"{gift['left']:,} из {gift['supply']:,}" if gift.get("supply") != None else gift.get("emoji")
 
@@ -280,47 +276,47 @@ async def confirm_purchase(call: CallbackQuery, state: FSMContext):
     data_target_chat_id=data.get("target_chat_id")
     gift_display = f"{gift['left']:,} из {gift['supply']:,}" if gift.get("supply") != None else gift.get("emoji")
 
-    bought = 0
-    while bought < qty:
-        if sender == 'bot':
-            success = await buy_gift(
-                bot=call.bot,
-                env_user_id=call.from_user.id,
-                gift_id=gift_id,
-                user_id=data_target_user_id,
-                chat_id=data_target_chat_id,
-                gift_price=gift_price,
-                file_id=None
-            )
-        elif sender == 'userbot':
-            success = await buy_gift_userbot(
-                session_user_id=call.from_user.id,
-                gift_id=gift_id,
-                target_user_id=data_target_user_id,
-                target_chat_id=data_target_chat_id,
-                gift_price=gift_price,
-                file_id=None
-            )
-        else:
-            success = False
-
-        if not success:
-            break
-
-        bought += 1
-        await asyncio.sleep(PURCHASE_COOLDOWN)
+    if sender == 'bot':
+        summary = await buy_gifts_batch(
+            bot=call.bot,
+            env_user_id=call.from_user.id,
+            gift_id=gift_id,
+            user_id=data_target_user_id,
+            chat_id=data_target_chat_id,
+            gift_price=gift_price,
+            quantity=qty
+        )
+    elif sender == 'userbot' and _sharded and not is_userbot_active(call.from_user.id):
+        # При WORKER_SHARDING=1 юзербот работает в процессе, захватившем владельца, —
+        # покупку выполнит этот процесс
+        await submit_order(
+            owner_id=call.from_user.id,
+            chat_id=call.message.chat.id,
+            gift_id=gift_id,
+            gift_price=gift_price,
+            quantity=qty,
+            target_user_id=data_target_user_id,
+            target_chat_id=data_target_chat_id,
+            gift_display=gift_display
+        )
+        summary = None
+    elif sender == 'userbot':
+        summary = await buy_gifts_userbot_batch(
+            session_user_id=call.from_user.id,
+            gift_id=gift_id,
+            target_user_id=data_target_user_id,
+            target_chat_id=data_target_chat_id,
+            gift_price=gift_price,
+            quantity=qty
+        )
+    else:
+        summary = {"bought": 0}
 
-    if bought == qty:
-        await call.message.answer(f"✅ Покупка <b>{gift_display}</b> успешно завершена!\n"
-                                  f"🎁 Куплено подарков: <b>{bought}</b> из <b>{qty}</b>\n"
-                                  f"👤 Получатель: {get_target_display_local(data_target_user_id, data_target_chat_id, call.from_user.id)}")
+    if summary is None:
+        await call.message.answer("⏳ Покупка передана юзерботу. Результат придёт отдельным сообщением.")
     else:
-        await call.message.answer(f"⚠️ Покупка <b>{gift_display}</b> остановлена.\n"
-                                  f"🎁 Куплено подарков: <b>{bought}</b> из <b>{qty}</b>\n"
-                                  f"👤 Получатель: {get_target_display_local(data_target_user_id, data_target_chat_id, call.from_user.id)}\n"
-                                  f"💰 Пополните баланс! Проверьте адрес получателя!\n"
-                                  f"📦 Проверьте доступность подарка!\n"
-                                  f"🚦 Статус изменён на 🔴 (неактивен).")
+        target_display = get_target_display_local(data_target_user_id, data_target_chat_id, call.from_user.id)
+        await call.message.answer(purchase_result_text(gift_display, summary["bought"], qty, target_display))
     
     await state.clear()
     await call.answer()
@@ -366,8 +362,12 @@ async def safe_edit_text(message, text, reply_markup=None):
             raise
 
 
-def register_catalog_handlers(dp):
+def register_catalog_handlers(dp, sharded: bool = False):
     """
     Регистрирует все хендлеры, связанные с каталогом подарков.
+
+    :param sharded: Покупки юзерботом передаются процессу, обслуживающему владельца (WORKER_SHARDING=1)
     """
+    global _sharded
+    _sharded = sharded
     dp.include_router(wizard_router)
@@ -6,9 +6,10 @@ from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 
 # --- Внутренние модули ---
-from services.config import get_valid_config, save_config, format_config_summary, get_target_display
+from services.config import get_valid_config, update_config, profile_field, format_config_summary, get_target_display
 from services.menu import update_menu, config_action_keyboard 
 from services.balance import refresh_balance
+from services.events import notify_worker
 from services.buy_bot import buy_gift
 from middlewares.access_control import show_guest_menu
 
@@ -153,12 +154,12 @@ def register_main_handlers(dp, bot, version):
         """
         config = await get_valid_config(call.from_user.id)
         # Сбросить счетчики во всех профилях
-        for profile in config["PROFILES"]:
-            profile["BOUGHT"] = 0
-            profile["SPENT"] = 0
-            profile["DONE"] = False
-        config["ACTIVE"] = False
-        await save_config(config, user_id=call.from_user.id)
+        fields = {"ACTIVE": False}
+        for idx in range(len(config["PROFILES"])):
+            fields[profile_field(idx, "BOUGHT")] = 0
+            fields[profile_field(idx, "SPENT")] = 0
+            fields[profile_field(idx, "DONE")] = False
+        config = await update_config(call.from_user.id, set_fields=fields, notify=True)
         info = format_config_summary(config, call.from_user.id)
         try:
             await call.message.edit_text(
@@ -177,8 +178,7 @@ def register_main_handlers(dp, bot, version):
         Переключение статуса работы бота: активен/неактивен.
         """
         config = await get_valid_config(call.from_user.id)
-        config["ACTIVE"] = not config.get("ACTIVE", False)
-        await save_config(config, user_id=call.from_user.id)
+        config = await update_config(call.from_user.id, set_fields={"ACTIVE": not config.get("ACTIVE", False)}, notify=True)
         info = format_config_summary(config, call.from_user.id)
         await call.message.edit_text(
             info,
@@ -205,4 +205,5 @@ def register_main_handlers(dp, bot, version):
             message_effect_id="5104841245755180586"
         )
         balance = await refresh_balance(bot, user_id=message.from_user.id)
+        notify_worker(reason="balance")
         await update_menu(bot=bot, chat_id=message.chat.id, user_id=message.from_user.id, message_id=message.message_id)
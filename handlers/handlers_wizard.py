@@ -10,11 +10,12 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.exceptions import TelegramBadRequest, TelegramAPIError
 
 # --- Внутренние модули ---
-from services.config import get_valid_config, get_target_display, save_config
+from services.config import get_valid_config, get_target_display, update_config, profile_field
 from services.menu import update_menu, payment_keyboard
 from services.balance import refresh_balance, refund_all_star_payments
 from services.config import CURRENCY, MAX_PROFILES, add_profile, remove_profile, update_profile
 from services.userbot import is_userbot_active, userbot_send_self, delete_userbot_session, start_userbot, continue_userbot_signin, finish_userbot_signin
+from services.recipients import schedule_warmup
 from middlewares.access_control import show_guest_menu
 from utils.misc import now_str, is_valid_profile_name, PHONE_REGEX, API_HASH_REGEX
 
@@ -179,9 +180,7 @@ async def userbot_enable_handler(call: CallbackQuery):
     username = call.from_user.username
     bot_user = await call.bot.get_me()
     bot_username = bot_user.username
-    config = await get_valid_config(user_id)
-    config["USERBOT"]["ENABLED"] = True
-    await save_config(config, user_id=user_id)
+    await update_config(user_id, set_fields={"USERBOT.ENABLED": True}, notify=True)
 
     await call.answer()
 
@@ -210,9 +209,7 @@ async def userbot_disable_handler(call: CallbackQuery):
     username = call.from_user.username
     bot_user = await call.bot.get_me()
     bot_username = bot_user.username
-    config = await get_valid_config(user_id)
-    config["USERBOT"]["ENABLED"] = False
-    await save_config(config, user_id=user_id)
+    await update_config(user_id, set_fields={"USERBOT.ENABLED": False}, notify=True)
 
     await call.answer()
 
@@ -580,8 +577,7 @@ async def on_profile_name_entered(message: Message, state: FSMContext):
         await state.clear()
         return
 
-    profiles[idx]["NAME"] = name
-    await save_config(config, user_id=message.from_user.id)
+    await update_config(message.from_user.id, set_fields={profile_field(idx, "NAME"): name}, notify=True)
     await message.answer(f"✅ Имя профиля успешно изменено на: <b>{name}</b>")
 
     # Вернуться к меню профилей (вызывайте свою функцию профилей)
@@ -844,10 +840,10 @@ async def step_edit_max_price(message: Message, state: FSMContext):
             await message.answer("🚫 Максимальная цена не может быть меньше минимальной. Попробуйте ещё раз.\n\n/cancel — отмена")
             return
 
-        config = await get_valid_config(message.from_user.id)
-        config["PROFILES"][idx]["MIN_PRICE"] = data["MIN_PRICE"]
-        config["PROFILES"][idx]["MAX_PRICE"] = value
-        await save_config(config, user_id=message.from_user.id)
+        config = await update_config(message.from_user.id, set_fields={
+            profile_field(idx, "MIN_PRICE"): data["MIN_PRICE"],
+            profile_field(idx, "MAX_PRICE"): value,
+        }, notify=True)
 
         try:
             await message.bot.delete_message(message.chat.id, data["message_id"])
@@ -923,10 +919,10 @@ async def step_edit_max_supply(message: Message, state: FSMContext):
             await message.answer("🚫 Максимальный саплай не может быть меньше минимального. Попробуйте ещё раз.\n\n/cancel — отмена")
             return
         
-        config = await get_valid_config(message.from_user.id)
-        config["PROFILES"][idx]["MIN_SUPPLY"] = data["MIN_SUPPLY"]
-        config["PROFILES"][idx]["MAX_SUPPLY"] = value
-        await save_config(config, user_id=message.from_user.id)
+        config = await update_config(message.from_user.id, set_fields={
+            profile_field(idx, "MIN_SUPPLY"): data["MIN_SUPPLY"],
+            profile_field(idx, "MAX_SUPPLY"): value,
+        }, notify=True)
 
         try:
             await message.bot.delete_message(message.chat.id, data["message_id"])
@@ -963,9 +959,7 @@ async def step_edit_limit(message: Message, state: FSMContext):
         if value <= 0:
             raise ValueError
         
-        config = await get_valid_config(message.from_user.id)
-        config["PROFILES"][idx]["LIMIT"] = value
-        await save_config(config, user_id=message.from_user.id)
+        config = await update_config(message.from_user.id, set_fields={profile_field(idx, "LIMIT"): value}, notify=True)
 
         try:
             await message.bot.delete_message(message.chat.id, data["message_id"])
@@ -1002,9 +996,7 @@ async def step_edit_count(message: Message, state: FSMContext):
         if value <= 0:
             raise ValueError
         
-        config = await get_valid_config(message.from_user.id)
-        config["PROFILES"][idx]["COUNT"] = value
-        await save_config(config, user_id=message.from_user.id)
+        config = await update_config(message.from_user.id, set_fields={profile_field(idx, "COUNT"): value}, notify=True)
 
         try:
             await message.bot.delete_message(message.chat.id, data["message_id"])
@@ -1058,11 +1050,12 @@ async def step_edit_user_id(message: Message, state: FSMContext):
         await message.answer("🚫 Введите ID или @username канала. Попробуйте ещё раз.\n\n/cancel — отмена")
         return
     
-    config = await get_valid_config(message.from_user.id)
-    config["PROFILES"][idx]["TARGET_USER_ID"] = target_user
-    config["PROFILES"][idx]["TARGET_CHAT_ID"] = target_chat
-    config["PROFILES"][idx]["TARGET_TYPE"] = target_type
-    await save_config(config, user_id=message.from_user.id)
+    config = await update_config(message.from_user.id, set_fields={
+        profile_field(idx, "TARGET_USER_ID"): target_user,
+        profile_field(idx, "TARGET_CHAT_ID"): target_chat,
+        profile_field(idx, "TARGET_TYPE"): target_type,
+    }, notify=True)
+    schedule_warmup(message.bot, message.from_user.id, target_user, target_chat)
 
     try:
         await message.bot.delete_message(message.chat.id, data["message_id"])
@@ -1190,6 +1183,7 @@ async def step_user_id(message: Message, state: FSMContext):
     }
 
     await state.update_data(profile_data=profile_data)
+    schedule_warmup(message.bot, message.from_user.id, target_user, target_chat)
 
     # Переход к шагу выбора отправителя
     await message.answer("📤 Выберите <b>отправителя</b> подарков:\n\n"
@@ -1267,8 +1261,7 @@ async def on_profile_delete_final(call: CallbackQuery):
     deafult_added = ("\n➕ <b>Добавлен</b> стандартный профиль.\n"
                      "🚦 Статус изменён на 🔴 (неактивен)." if len(config["PROFILES"]) == 1 else "")
     if len(config["PROFILES"]) == 1:
-        config["ACTIVE"] = False
-        await save_config(config, user_id=call.from_user.id)
+        config = await update_config(call.from_user.id, set_fields={"ACTIVE": False})
     await remove_profile(config, idx, call.from_user.id)
     await call.message.edit_text(f"✅ <b>Профиль {idx + 1}</b> удалён.{deafult_added}", reply_markup=None)
     await profiles_menu(call.message, call.from_user.id)
@@ -1653,7 +1646,6 @@ async def withdraw_all_confirmed(call: CallbackQuery):
     result = await refund_all_star_payments(
         bot=call.bot,
         user_id=call.from_user.id,
-        username=call.from_user.username,
         message_func=send_status,
     )
     if result["count"] > 0:
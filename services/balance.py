@@ -1,16 +1,167 @@
 # --- Стандартные библиотеки ---
-from itertools import combinations
+from typing import NamedTuple
+import asyncio
 import logging
+import math
+import time
 
 # --- Внутренние модули ---
-from services.config import load_config, save_config
-from services.userbot import get_userbot_stars_balance
+from services.config import (
+    load_config, get_valid_config, update_config, userbot_account_field,
+    LEDGER_FLUSH_INTERVAL, REFUND_PLAN_TIME_BUDGET, REFUND_PLAN_MEMORY_LIMIT, REFUND_CONCURRENCY, REFUND_RETRIES, REFUND_PROGRESS_STEP
+)
+from services.userbot import get_userbot_stars_balance, is_userbot_active
+from services.userbot_pool import get_accounts
+from services.transactions import sync_star_transactions, get_transactions_balance, get_unrefunded_deposits, mark_refunded
 
 # --- Сторонние библиотеки ---
 from aiogram.types.star_amount import StarAmount
+from aiogram.exceptions import TelegramRetryAfter
 
 logger = logging.getLogger(__name__)
 
+
+class StarLedger:
+    """
+    Баланс звёзд одного счёта (общий кошелёк бота или юзербот владельца) в памяти.
+
+    Перед отправкой подарка звёзды резервируются (reserve), после — списываются (commit)
+    или возвращаются в доступные (release). Все операции синхронные, поэтому параллельные
+    покупки в одном event loop не могут потратить больше, чем есть. Списания копятся
+    и пишутся в MongoDB пачкой через LEDGER_FLUSH_INTERVAL секунд.
+
+    Кошелёк бота один на всех владельцев, поэтому его леджер общий (user_id=None):
+    BALANCE в конфиге каждого владельца — копия баланса кошелька, и при записи
+    она обновляется у всех владельцев, покупавших через бота.
+    """
+
+    def __init__(self, user_id: int | None, account: str, balance: int):
+        """
+        :param user_id: Telegram ID владельца конфига (None — общий кошелёк бота)
+        :param account: "bot", "userbot" или "userbot:<имя сессии>" для дополнительного аккаунта
+        :param balance: Начальный баланс из конфига
+        """
+        self.user_id = user_id
+        self.account = account
+        self.balance = balance
+        self.reserved = 0
+        self.owners: set[int] = set()  # Владельцы, чьи конфиги хранят копию баланса общего кошелька
+        self._pending = 0  # Ещё не записанное в MongoDB изменение баланса
+        self._flush_task: asyncio.Task | None = None
+
+    @property
+    def available(self) -> int:
+        """
+        Звёзды, доступные для новых покупок (баланс минус резерв).
+        """
+        return self.balance - self.reserved
+
+    def reserve(self, amount: int) -> bool:
+        """
+        Резервирует amount звёзд. Возвращает False, если доступных звёзд не хватает.
+        """
+        if self.available < amount:
+            return False
+        self.reserved += amount
+        return True
+
+    def release(self, amount: int) -> None:
+        """
+        Снимает резерв после неудачной покупки.
+        """
+        self.reserved = max(0, self.reserved - amount)
+
+    def commit(self, amount: int) -> int:
+        """
+        Списывает зарезервированные звёзды после успешной покупки и планирует запись в MongoDB.
+
+        :return: Новый баланс
+        """
+        self.reserved = max(0, self.reserved - amount)
+        self.balance = max(0, self.balance - amount)
+        self._pending -= amount
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+        return self.balance
+
+    def set_balance(self, balance: int) -> None:
+        """
+        Устанавливает актуальный баланс из Telegram; незаписанные списания уже учтены в нём.
+        """
+        self.balance = balance
+        self._pending = 0
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(LEDGER_FLUSH_INTERVAL)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """
+        Записывает накопленное изменение баланса в конфиг одним $inc
+        (для общего кошелька бота — текущий баланс в конфиги его владельцев).
+        """
+        delta, self._pending = self._pending, 0
+        if not delta:
+            return
+        try:
+            if self.user_id is None:
+                for owner_id in list(self.owners):
+                    await update_config(owner_id, set_fields={"BALANCE": self.balance})
+            elif self.account == "userbot":
+                await change_balance_userbot(delta, user_id=self.user_id)
+            elif self.account.startswith("userbot:"):
+                await change_balance_userbot_account(delta, self.account.split(":", 1)[1], user_id=self.user_id)
+            else:
+                await change_balance(delta, user_id=self.user_id)
+        except Exception as e:
+            self._pending += delta
+            logger.error(f"Не удалось записать баланс ({self.account}) user_id={self.user_id}: {e}")
+
+
+_ledgers: dict[tuple[int | None, str], StarLedger] = {}
+
+
+def _ledger_key(user_id: int, account: str) -> tuple[int | None, str]:
+    # Кошелёк бота один на процесс — леджер общий для всех владельцев
+    return (None, account) if account == "bot" else (user_id, account)
+
+
+async def get_ledger(user_id: int, account: str = "bot") -> StarLedger:
+    """
+    Возвращает баланс-леджер счёта, при первом обращении загружая баланс из конфига.
+    Для "bot" возвращается общий леджер кошелька бота, владелец добавляется в его owners.
+
+    :param user_id: Telegram ID владельца конфига
+    :param account: "bot", "userbot" или "userbot:<имя сессии>"
+    """
+    key = _ledger_key(user_id, account)
+    ledger = _ledgers.get(key)
+    if ledger is None:
+        config = await get_valid_config(user_id)
+        if account == "userbot":
+            balance = config.get("USERBOT", {}).get("BALANCE", 0)
+        elif account.startswith("userbot:"):
+            index = _userbot_account_index(config, account.split(":", 1)[1])
+            accounts = config.get("USERBOT", {}).get("ACCOUNTS", [])
+            balance = accounts[index].get("BALANCE", 0) if index is not None else 0
+        else:
+            balance = config.get("BALANCE", 0)
+        # Пока грузили конфиг, леджер мог создать параллельный вызов
+        ledger = _ledgers.setdefault(key, StarLedger(key[0], account, balance))
+    if key[0] is None:
+        ledger.owners.add(user_id)
+    return ledger
+
+
+async def flush_ledgers(user_id: int | None = None) -> None:
+    """
+    Немедленно записывает накопленные изменения балансов (всех или одного владельца).
+    """
+    for (owner_id, _), ledger in list(_ledgers.items()):
+        if user_id is None or owner_id == user_id or (owner_id is None and user_id in ledger.owners):
+            await ledger.flush()
+
+
 async def get_stars_balance(bot) -> int:
     """
     Получает баланс звёзд через API бота (актуальный метод).
@@ -24,63 +175,67 @@ async def get_stars_balance(bot) -> int:
 async def get_stars_balance_by_transactions(bot) -> int:
     """
     Получает суммарный баланс звёзд по всем транзакциям пользователя через API бота (устаревший метод).
+    Транзакции хранятся в MongoDB, из API догружаются только новые страницы.
     """
-    offset = 0
-    limit = 100
-    balance = 0
-
-    while True:
-        get_transactions = await bot.get_star_transactions(offset=offset, limit=limit)
-        transactions = get_transactions.transactions
-
-        if not transactions:
-            break
-
-        for transaction in transactions:
-            source = transaction.source
-            amount = transaction.amount
-            if source is not None:
-                balance += amount
-            else:
-                balance -= amount
-
-        offset += limit
-
-    return balance
+    return await get_transactions_balance(bot)
 
 
 async def refresh_balance(bot, user_id: int | None = None) -> int:
     """
     Обновляет и сохраняет баланс звёзд в конфиге, возвращает актуальное значение.
     """
+    # Незаписанные списания сначала сохраняем, чтобы не потерять их при перезаписи баланса
+    if user_id is not None:
+        await flush_ledgers(user_id)
+
     # Загрузка конфига
     # Требуем user_id для мультиязычного (мультиюзерного) режима; сохраняем обратную совместимость
     config = await load_config(user_id=user_id)
     userbot_data = config.get("USERBOT", {})
 
-    # Баланс userbot-а (если сессия существует)
+    # Есть ли сохранённая userbot-сессия
     has_session = (
         userbot_data.get("API_ID")
         and userbot_data.get("API_HASH")
         and userbot_data.get("PHONE")
     )
-    if has_session:
+    # Баланс основного бота
+    balance = await get_stars_balance(bot)
+    balances = {"BALANCE": balance}
+    ledger_balances = {"bot": balance}
+
+    # Баланс userbot-а (если сессия существует). Если клиент запущен в другом
+    # процессе-воркере (WORKER_SHARDING=1), сохранённый баланс не трогаем
+    if not has_session:
+        logger.info("Userbot-сессия неактивна или не настроена.")
+        balances["USERBOT.BALANCE"] = ledger_balances["userbot"] = 0
+    elif is_userbot_active(user_id):
         try:
-            userbot_balance = await get_userbot_balance(user_id)
-            config["USERBOT"]["BALANCE"] = userbot_balance
+            balances["USERBOT.BALANCE"] = ledger_balances["userbot"] = await get_userbot_balance(user_id)
         except Exception as e:
-            config["USERBOT"]["BALANCE"] = 0
             logger.error(f"Не удалось получить баланс userbot: {e}")
-    else:
-        logger.info("Userbot-сессия неактивна или не настроена.")
-        config["USERBOT"]["BALANCE"] = 0
-
-    # Баланс основного бота
-    balance = await get_stars_balance(bot)
-    config["BALANCE"] = balance
 
-    # Сохраняем всё
-    await save_config(config, user_id=user_id)
+    # Балансы дополнительных аккаунтов пула юзерботов
+    if user_id is not None:
+        for entry in get_accounts(user_id):
+            index = _userbot_account_index(config, entry.name)
+            if entry.is_primary or index is None:
+                continue
+            try:
+                value = await entry.client.get_stars_balance()
+            except Exception as e:
+                logger.error(f"Не удалось получить баланс аккаунта {entry.name}: {e}")
+                continue
+            balances[userbot_account_field(index, "BALANCE")] = value
+            ledger_balances[entry.account] = value
+
+    # Сохраняем только балансы
+    await update_config(user_id, set_fields=balances)
+    if user_id is not None:
+        for account, value in ledger_balances.items():
+            ledger = _ledgers.get(_ledger_key(user_id, account))
+            if ledger:
+                ledger.set_balance(value)
     return balance
 
 
@@ -88,10 +243,11 @@ async def change_balance(delta: int, user_id: int | None = None) -> int:
     """
     Изменяет баланс звёзд в конфиге на указанное значение delta, не допуская отрицательных значений.
     """
-    config = await load_config(user_id=user_id)
-    config["BALANCE"] = max(0, config.get("BALANCE", 0) + delta)
-    balance = config["BALANCE"]
-    await save_config(config, user_id=user_id)
+    config = await update_config(user_id, inc={"BALANCE": delta})
+    balance = config.get("BALANCE", 0)
+    if balance < 0:
+        config = await update_config(user_id, max_fields={"BALANCE": 0})
+        balance = config.get("BALANCE", 0)
     return balance
 
 
@@ -99,19 +255,193 @@ async def change_balance_userbot(delta: int, user_id: int | None = None) -> int:
     """
     Изменяет баланс звёзд юзербота в конфиге на указанное значение delta, не допуская отрицательных значений.
     """
-    config = await load_config(user_id=user_id)
-    userbot = config.get("USERBOT", {})
-    current = userbot.get("BALANCE", 0)
-    new_balance = max(0, current + delta)
+    config = await update_config(user_id, inc={"USERBOT.BALANCE": delta})
+    new_balance = config.get("USERBOT", {}).get("BALANCE", 0)
+    if new_balance < 0:
+        config = await update_config(user_id, max_fields={"USERBOT.BALANCE": 0})
+        new_balance = config.get("USERBOT", {}).get("BALANCE", 0)
+    return new_balance
+
+
+def _userbot_account_index(config: dict, session_name: str) -> int | None:
+    """
+    Возвращает индекс дополнительного аккаунта юзербота в USERBOT.ACCOUNTS по имени сессии.
+    """
+    for index, account in enumerate(config.get("USERBOT", {}).get("ACCOUNTS", [])):
+        if account.get("SESSION") == session_name:
+            return index
+    return None
+
 
-    config["USERBOT"]["BALANCE"] = new_balance
-    await save_config(config, user_id=user_id)
+async def change_balance_userbot_account(delta: int, session_name: str, user_id: int | None = None) -> int:
+    """
+    Изменяет баланс дополнительного аккаунта юзербота на delta, не допуская отрицательных значений.
+    """
+    config = await load_config(user_id)
+    index = _userbot_account_index(config, session_name)
+    if index is None:
+        logger.error(f"Дополнительный аккаунт юзербота {session_name} не найден в конфиге.")
+        return 0
+    field = userbot_account_field(index, "BALANCE")
+    config = await update_config(user_id, inc={field: delta})
+    new_balance = config["USERBOT"]["ACCOUNTS"][index].get("BALANCE", 0)
+    if new_balance < 0:
+        config = await update_config(user_id, max_fields={field: 0})
+        new_balance = config["USERBOT"]["ACCOUNTS"][index].get("BALANCE", 0)
     return new_balance
 
 
-async def refund_all_star_payments(bot, username, user_id, message_func=None):
+class RefundPlan(NamedTuple):
+    """
+    Результат подбора депозитов для возврата.
+    """
+    indices: tuple  # Индексы выбранных депозитов во входном списке
+    total: int  # Сумма выбранных депозитов
+    optimal: bool  # True — найдена максимально возможная сумма, False — жадное приближение
+
+
+def _greedy_refund(amounts: list[int], capacity: int) -> RefundPlan:
+    """
+    Жадный подбор: крупные депозиты первыми, пока помещаются в capacity.
+    """
+    chosen = []
+    total = 0
+    for i in sorted(range(len(amounts)), key=lambda i: amounts[i], reverse=True):
+        if total + amounts[i] <= capacity:
+            chosen.append(i)
+            total += amounts[i]
+    return RefundPlan(tuple(sorted(chosen)), total, total == capacity or len(chosen) == len(amounts))
+
+
+def plan_refund(amounts: list[int], capacity: int, time_budget: float | None = None) -> RefundPlan:
+    """
+    Подбирает депозиты с максимальной суммой, не превышающей capacity (задача subset-sum).
+
+    Достижимые суммы хранятся битовой маской в целом числе: после каждого депозита
+    reach |= reach << amount. Сложность — O(n * capacity / 64) машинных операций,
+    поэтому сотни депозитов и баланс в десятки тысяч звёзд обрабатываются за миллисекунды.
+    Для восстановления набора маски сохраняются не после каждого шага, а раз в ~sqrt(n)
+    депозитов: при восстановлении маски блока пересчитываются от контрольной точки.
+    Памяти нужно O(sqrt(n) * capacity) бит вместо O(n * capacity) ценой второго прохода;
+    если и это больше REFUND_PLAN_MEMORY_LIMIT — используется жадный вариант.
+
+    :param amounts: Суммы депозитов
+    :param capacity: Доступный для возврата баланс
+    :param time_budget: Ограничение времени в секундах; при превышении — жадный результат
+    :return: RefundPlan с индексами депозитов, суммой и признаком оптимальности
+    """
+    greedy = _greedy_refund(amounts, capacity)
+    if capacity <= 0 or greedy.optimal:
+        return greedy
+
+    # Выше суммы всех депозитов подниматься незачем
+    capacity = min(capacity, sum(a for a in amounts if a > 0))
+    mask = (1 << (capacity + 1)) - 1
+
+    # Шаг контрольных точек: их количество и длина блока примерно равны sqrt(n)
+    step = math.isqrt(max(len(amounts) - 1, 0)) + 1
+    mask_bytes = capacity // 8 + 1
+    if (-(-len(amounts) // step) + step) * mask_bytes > REFUND_PLAN_MEMORY_LIMIT:
+        logger.warning(f"Подбор возврата для баланса {capacity} превышает лимит памяти, используется жадный вариант")
+        return RefundPlan(greedy.indices, greedy.total, False)
+
+    deadline = time.monotonic() + time_budget if time_budget is not None else None
+
+    reach = 1  # Достижима только нулевая сумма
+    checkpoints = []  # Маска перед депозитом с индексом k * step
+    visited = 0
+    for i, amount in enumerate(amounts):
+        if i % step == 0:
+            checkpoints.append(reach)
+        visited = i + 1
+        if 0 < amount <= capacity:
+            reach = (reach | (reach << amount)) & mask
+            if reach >> capacity & 1:
+                break
+        if deadline is not None and time.monotonic() > deadline:
+            logger.warning(f"Подбор возврата не уложился в {time_budget} сек., используется жадный вариант")
+            return RefundPlan(greedy.indices, greedy.total, False)
+
+    best = reach.bit_length() - 1
+    if best <= greedy.total:
+        return RefundPlan(greedy.indices, greedy.total, True)
+
+    # Восстанавливаем набор с конца по блокам: депозит взят, если сумма не была достижима без него
+    chosen = []
+    target = best
+    for block_index in range(len(checkpoints) - 1, -1, -1):
+        start = block_index * step
+        end = min(start + step, visited)
+        history = []  # Маски перед каждым депозитом блока
+        block_reach = checkpoints[block_index]
+        for i in range(start, end):
+            history.append(block_reach)
+            if 0 < amounts[i] <= capacity:
+                block_reach = (block_reach | (block_reach << amounts[i])) & mask
+        for i in range(end - 1, start - 1, -1):
+            if not (history[i - start] >> target & 1):
+                chosen.append(i)
+                target -= amounts[i]
+    return RefundPlan(tuple(sorted(chosen)), best, True)
+
+
+async def execute_refunds(bot, user_id: int, deposits: list[dict], message_func=None) -> list[dict]:
+    """
+    Выполняет возвраты по депозитам параллельно, не более REFUND_CONCURRENCY одновременно.
+
+    При RetryAfter все возвраты приостанавливаются на указанное Telegram время,
+    транзакция повторяется до REFUND_RETRIES раз. Каждые REFUND_PROGRESS_STEP выполненных
+    возвратов пользователю отправляется сообщение о прогрессе.
+
+    :param bot: Экземпляр aiogram Bot
+    :param user_id: Telegram ID пользователя, которому возвращаются звёзды
+    :param deposits: Депозиты из services.transactions (txn_id, amount)
+    :param message_func: Асинхронная функция отправки сообщения пользователю
+    :return: Результаты по каждой транзакции: {"txn_id", "amount", "ok", "error"}
     """
-    Возвращает звёзды только по депозитам без возврата, совершённым указанным username.
+    semaphore = asyncio.Semaphore(REFUND_CONCURRENCY)
+    pause = {"until": 0.0}  # Общая пауза после RetryAfter
+    outcomes = []
+    total = len(deposits)
+
+    async def refund_one(txn: dict) -> dict:
+        outcome = {"txn_id": txn.get("txn_id"), "amount": txn["amount"], "ok": False, "error": None}
+        async with semaphore:
+            for attempt in range(1, REFUND_RETRIES + 1):
+                delay = pause["until"] - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                try:
+                    await bot.refund_star_payment(
+                        user_id=user_id,
+                        telegram_payment_charge_id=outcome["txn_id"]
+                    )
+                    outcome["ok"] = True
+                    outcome["error"] = None
+                    break
+                except TelegramRetryAfter as e:
+                    logger.warning(f"RetryAfter при возврате {outcome['txn_id']}: ждём {e.retry_after} сек.")
+                    pause["until"] = max(pause["until"], time.monotonic() + e.retry_after)
+                    outcome["error"] = str(e)
+                except Exception as e:
+                    logger.error(f"Ошибка при возврате {outcome['txn_id']}: {e}")
+                    outcome["error"] = str(e)
+                    break
+
+        outcomes.append(outcome)
+        if message_func:
+            if not outcome["ok"]:
+                await message_func(f"🚫 Ошибка при возврате ★{outcome['amount']}")
+            elif total > REFUND_PROGRESS_STEP and len(outcomes) % REFUND_PROGRESS_STEP == 0:
+                await message_func(f"⏳ Выполнено возвратов: {len(outcomes)} из {total}")
+        return outcome
+
+    return await asyncio.gather(*(refund_one(txn) for txn in deposits if txn.get("txn_id")))
+
+
+async def refund_all_star_payments(bot, user_id, message_func=None):
+    """
+    Возвращает звёзды только по депозитам без возврата, совершённым пользователем user_id.
     Подбирает оптимальную комбинацию для вывода максимально возможной суммы.
     При необходимости сообщает пользователю о дальнейших действиях.
     """
@@ -119,85 +449,43 @@ async def refund_all_star_payments(bot, username, user_id, message_func=None):
     if balance <= 0:
         return {"refunded": 0, "count": 0, "txn_ids": [], "left": 0}
 
-    # Получаем все транзакции
-    offset = 0
-    limit = 100
-    all_txns = []
-    while True:
-        res = await bot.get_star_transactions(offset=offset, limit=limit)
-        txns = res.transactions
-        if not txns:
-            break
-        all_txns.extend(txns)
-        offset += limit
-
-    # Фильтруем депозиты без возврата и только с нужным username
-    deposits = [
-        t for t in all_txns
-        if t.source is not None
-        and getattr(t.source, "user", None)
-        and getattr(t.source.user, "username", None) == username
-    ]
-    refunded_ids = {t.id for t in all_txns if t.source is None}
-    unrefunded_deposits = [t for t in deposits if t.id not in refunded_ids]
-
-    n = len(unrefunded_deposits)
-    best_combo = []
-    best_sum = 0
-
-    # Ищем идеальную комбинацию или greedy
-    if n <= 18:
-        for r in range(1, n+1):
-            for combo in combinations(unrefunded_deposits, r):
-                s = sum(t.amount for t in combo)
-                if s <= balance and s > best_sum:
-                    best_combo = combo
-                    best_sum = s
-                if best_sum == balance:
-                    break
-            if best_sum == balance:
-                break
-    else:
-        unrefunded_deposits.sort(key=lambda t: t.amount, reverse=True)
-        curr_sum = 0
-        best_combo = []
-        for t in unrefunded_deposits:
-            if curr_sum + t.amount <= balance:
-                best_combo.append(t)
-                curr_sum += t.amount
-        best_sum = curr_sum
+    # Догружаем новые транзакции и берём депозиты пользователя без возврата по индексу
+    await sync_star_transactions(bot)
+    unrefunded_deposits = await get_unrefunded_deposits(bot, user_id)
+
+    # Подбор — CPU-задача, выполняем вне event loop
+    plan = await asyncio.to_thread(
+        plan_refund,
+        [t["amount"] for t in unrefunded_deposits],
+        balance,
+        REFUND_PLAN_TIME_BUDGET
+    )
+    best_combo = [unrefunded_deposits[i] for i in plan.indices]
+    best_sum = plan.total
+    logger.info(
+        f"План возврата: ★{best_sum} из ★{balance} по {len(best_combo)} из {len(unrefunded_deposits)} депозитов"
+        f" ({'оптимальный' if plan.optimal else 'приближённый'})"
+    )
 
     if not best_combo:
         return {"refunded": 0, "count": 0, "txn_ids": [], "left": balance}
 
     # Делаем возвраты только по выбранным транзакциям
-    total_refunded = 0
-    refund_ids = []
-    for txn in best_combo:
-        txn_id = getattr(txn, "id", None)
-        if not txn_id:
-            continue
-        try:
-            await bot.refund_star_payment(
-                user_id=user_id,
-                telegram_payment_charge_id=txn_id
-            )
-            total_refunded += txn.amount
-            refund_ids.append(txn_id)
-        except Exception as e:
-            if message_func:
-                await message_func(f"🚫 Ошибка при возврате ★{txn.amount}")
+    outcomes = await execute_refunds(bot, user_id, best_combo, message_func=message_func)
+    refund_ids = [o["txn_id"] for o in outcomes if o["ok"]]
+    total_refunded = sum(o["amount"] for o in outcomes if o["ok"])
+    await mark_refunded(bot, refund_ids)
 
     left = balance - best_sum
 
     # Находим транзакцию, которой хватит чтобы покрыть остаток
     # Берём минимальную сумму среди транзакций, где amount > min_needed
     def find_next_possible_deposit(unused_deposits, min_needed):
-        bigger = [t for t in unused_deposits if t.amount > min_needed]
+        bigger = [t for t in unused_deposits if t["amount"] > min_needed]
         if not bigger:
             return None
-        best = min(bigger, key=lambda t: t.amount)
-        return {"amount": best.amount, "id": getattr(best, "id", None)}
+        best = min(bigger, key=lambda t: t["amount"])
+        return {"amount": best["amount"], "id": best.get("txn_id")}
 
     unused_deposits = [t for t in unrefunded_deposits if t not in best_combo]
     next_possible = None
@@ -209,7 +497,8 @@ async def refund_all_star_payments(bot, username, user_id, message_func=None):
         "count": len(refund_ids),
         "txn_ids": refund_ids,
         "left": left,
-        "next_deposit": next_possible
+        "next_deposit": next_possible,
+        "optimal": plan.optimal
     }
 
 
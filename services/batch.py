@@ -0,0 +1,56 @@
+# --- Стандартные библиотеки ---
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+async def run_batch(
+    purchase: Callable[[], Awaitable[bool]],
+    quantity: int,
+    gift_price: int,
+    concurrency: int,
+    stop_on_failure: bool = True
+) -> dict:
+    """
+    Выполняет quantity одинаковых покупок конвейером: одновременно в полёте до concurrency запросов,
+    частоту по-прежнему ограничивает лимитер отправителя внутри purchase.
+
+    :param purchase: Асинхронная функция одной покупки, возвращает True при успехе
+    :param quantity: Сколько подарков купить
+    :param gift_price: Цена одного подарка (для итоговой суммы)
+    :param concurrency: Максимум одновременных покупок
+    :param stop_on_failure: После первой неудачи новые покупки не запускаются (нет звёзд, подарок закончился)
+    :return: {"results": [результат purchase или None по каждому подарку], "bought", "failed", "skipped", "spent"};
+             ложный результат, отличный от False (например, SOLD_OUT), останавливает пакет, но ошибкой не считается
+    """
+    results: list[bool | None] = [None] * quantity
+    next_index = 0
+    stopped = False
+
+    async def worker() -> None:
+        nonlocal next_index, stopped
+        while not stopped and next_index < quantity:
+            index = next_index
+            next_index += 1
+            try:
+                ok = await purchase()
+            except Exception as e:
+                logger.error(f"Ошибка покупки {index + 1}/{quantity} в пакете: {e}")
+                ok = False
+            results[index] = ok
+            if not ok and stop_on_failure:
+                stopped = True
+
+    await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, quantity)))))
+
+    bought = sum(1 for r in results if r is True)
+    failed = sum(1 for r in results if r is False)
+    return {
+        "results": results,
+        "bought": bought,
+        "failed": failed,
+        "skipped": quantity - bought - failed,
+        "spent": bought * gift_price,
+    }
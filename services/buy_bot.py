@@ -7,8 +7,12 @@ import random
 from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter
 
 # --- Внутренние модули ---
-from services.config import get_valid_config, save_config, DEV_MODE
-from services.balance import change_balance
+from services.config import update_config, DEV_MODE, PURCHASE_PIPELINE_DEPTH
+from services.balance import get_ledger
+from services.recipients import get_bot_chat_id
+from services.rate_limiter import get_purchase_limiter
+from services.batch import run_batch
+from services.catalog import record_purchase, mark_exhausted, SOLD_OUT
 
 logger = logging.getLogger(__name__)
 
@@ -36,8 +40,11 @@ async def buy_gift(
         file_id: ID файла (не используется в этой версии бота).
         retries: Количество попыток при ошибках.
 
+    Частота отправки ограничивается токен-бакетом бота (services.rate_limiter),
+    баланс проверяется и списывается через леджер в памяти (services.balance.StarLedger).
+
     Возвращает:
-        True, если покупка успешна, иначе False.
+        True, если покупка успешна, SOLD_OUT (ложное значение), если подарок распродан, иначе False.
     """
     # Тестовая логика
     if add_test_purchases or DEV_MODE:
@@ -45,46 +52,94 @@ async def buy_gift(
         logger.info(f"[ТЕСТ] ({result}) Покупка подарка {gift_id} за {gift_price} (имитация, баланс не трогаем)")
         return result
     
-    # Обычная логика
-    config = await get_valid_config(env_user_id)
-    balance = config["BALANCE"]
-    if balance < gift_price:
-        logger.error(f"Недостаточно звёзд для покупки подарка {gift_id} (требуется: {gift_price}, доступно: {balance})")
-        
-        config = await get_valid_config(env_user_id)
-        config["ACTIVE"] = False
-        await save_config(config, user_id=env_user_id)
+    # Обычная логика: резервируем звёзды до отправки
+    ledger = await get_ledger(env_user_id, "bot")
+    if not ledger.reserve(gift_price):
+        logger.error(f"Недостаточно звёзд для покупки подарка {gift_id} (требуется: {gift_price}, доступно: {ledger.available})")
+
+        await update_config(env_user_id, set_fields={"ACTIVE": False})
 
         return False
-    
-    for attempt in range(1, retries + 1):
-        try:
-            if user_id is not None and chat_id is None:
-                result = await bot.send_gift(gift_id=gift_id, user_id=user_id)
-            elif user_id is None and chat_id is not None:
-                result = await bot.send_gift(gift_id=gift_id, chat_id=chat_id)
-            else:
-                logger.warning("Указаны оба параметра — user_id и chat_id. Прерываем.")
+
+    committed = False
+    limiter = get_purchase_limiter(f"bot:{bot.id}")
+    try:
+        for attempt in range(1, retries + 1):
+            await limiter.acquire()
+            try:
+                if user_id is not None and chat_id is None:
+                    result = await bot.send_gift(gift_id=gift_id, user_id=user_id)
+                elif user_id is None and chat_id is not None:
+                    result = await bot.send_gift(gift_id=gift_id, chat_id=get_bot_chat_id(chat_id))
+                else:
+                    logger.warning("Указаны оба параметра — user_id и chat_id. Прерываем.")
+                    break
+
+                if result:
+                    limiter.on_success()
+                    new_balance = ledger.commit(int(gift_price))
+                    committed = True
+                    record_purchase(gift_id)
+                    logger.info(f"Успешная покупка подарка {gift_id} за {gift_price} звёзд. Остаток: {new_balance}")
+                    return True
+
+                logger.error(f"Попытка {attempt}/{retries}: Не удалось купить подарок {gift_id}. Повтор...")
+
+            except TelegramRetryAfter as e:
+                # Пауза выдерживается в лимитере перед следующей попыткой
+                logger.error(f"Flood wait: ждём {e.retry_after} секунд")
+                limiter.on_retry_after(e.retry_after)
+
+            except TelegramNetworkError as e:
+                logger.error(f"Попытка {attempt}/{retries}: Сетевая ошибка: {e}. Повтор через {2**attempt} секунд...")
+                await asyncio.sleep(2**attempt)
+
+            except TelegramAPIError as e:
+                if "STARGIFT_USAGE_LIMITED" in str(e):
+                    logger.warning(f"Подарок {gift_id} распродан")
+                    mark_exhausted(gift_id)
+                    return SOLD_OUT
+                logger.error(f"Ошибка Telegram API: {e}")
                 break
 
-            if result:
-                new_balance = await change_balance(int(-gift_price), user_id=env_user_id)
-                logger.info(f"Успешная покупка подарка {gift_id} за {gift_price} звёзд. Остаток: {new_balance}")
-                return True
-            
-            logger.error(f"Попытка {attempt}/{retries}: Не удалось купить подарок {gift_id}. Повтор...")
+        logger.error(f"Не удалось купить подарок {gift_id} после {retries} попыток.")
+        return False
+    finally:
+        # Покупка не прошла — возвращаем резерв в доступные звёзды
+        if not committed:
+            ledger.release(gift_price)
 
-        except TelegramRetryAfter as e:
-            logger.error(f"Flood wait: ждём {e.retry_after} секунд")
-            await asyncio.sleep(e.retry_after)
 
-        except TelegramNetworkError as e:
-            logger.error(f"Попытка {attempt}/{retries}: Сетевая ошибка: {e}. Повтор через {2**attempt} секунд...")
-            await asyncio.sleep(2**attempt)
+async def buy_gifts_batch(
+    bot,
+    env_user_id,
+    gift_id,
+    user_id,
+    chat_id,
+    gift_price,
+    quantity,
+    concurrency=PURCHASE_PIPELINE_DEPTH
+):
+    """
+    Покупает quantity одинаковых подарков одному получателю конвейером из concurrency запросов.
+    После первой неудачной покупки новые не запускаются.
 
-        except TelegramAPIError as e:
-            logger.error(f"Ошибка Telegram API: {e}")
-            break
+    Аргументы:
+        bot: Экземпляр бота.
+        env_user_id: ID пользователя из окружения (конфиг).
+        gift_id: ID подарка.
+        user_id: ID пользователя-получателя (может быть None).
+        chat_id: ID чата-получателя (может быть None).
+        gift_price: Стоимость подарка.
+        quantity: Количество подарков.
+        concurrency: Максимум одновременных покупок.
 
-    logger.error(f"Не удалось купить подарок {gift_id} после {retries} попыток.")
-    return False
\ No newline at end of file
+    Возвращает:
+        Словарь run_batch: результаты по каждому подарку и итоги (bought, failed, skipped, spent).
+    """
+    return await run_batch(
+        lambda: buy_gift(bot, env_user_id, gift_id, user_id, chat_id, gift_price, file_id=None),
+        quantity,
+        gift_price,
+        concurrency
+    )
@@ -4,18 +4,21 @@ import logging
 import random
 
 # --- Внутренние модули ---
-from services.config import get_valid_config, save_config, DEV_MODE
-from services.balance import change_balance_userbot
-from services.userbot import get_userbot_client
+from services.config import update_config, DEV_MODE, PURCHASE_PIPELINE_DEPTH
+from services.balance import get_ledger
+from services.userbot_pool import UserbotAccount, get_accounts, get_available_accounts
+from services.recipients import get_userbot_peer
+from services.batch import run_batch
+from services.catalog import record_purchase, mark_exhausted, SOLD_OUT
 
-from pyrogram import Client
 from pyrogram.types import Message
 from pyrogram.errors import (
     FloodWait,
     BadRequest,
     Forbidden,
     RPCError,
-    AuthKeyUnregistered
+    AuthKeyUnregistered,
+    StargiftUsageLimited
 )
 
 logger = logging.getLogger(__name__)
@@ -41,54 +44,68 @@ async def buy_gift_userbot(
     :param file_id: Не используется (зарезервировано)
     :param retries: Количество попыток
     :param add_test_purchases: Включает случайные покупки в режиме разработки
-    :return: True, если покупка успешна
+    :return: True, если покупка успешна, SOLD_OUT (ложное значение), если подарок распродан, иначе False
+
+    Покупка отправляется через наименее загруженный доступный аккаунт из пула юзерботов
+    владельца (services.userbot_pool), у которого хватает звёзд. Частота отправки ограничивается
+    токен-бакетом аккаунта, баланс резервируется и списывается через его леджер
+    (services.balance.StarLedger). После FloodWait или потери соединения следующая попытка
+    уходит через другой аккаунт; недоступные аккаунты (services.userbot_health) пропускаются.
     """
     if add_test_purchases or DEV_MODE:
         result = random.choice([True, True, True, False])
         logger.info(f"[ТЕСТ] ({result}) Покупка подарка {gift_id} за {gift_price} (userbot, имитация)")
         return result
 
-    config = await get_valid_config(session_user_id)
-    userbot_config = config.get("USERBOT", {})
-    userbot_balance = userbot_config.get("BALANCE", 0)
-
-    if userbot_balance < gift_price:
-        logger.error(f"Недостаточно звёзд для покупки подарка {gift_id} (требуется: {gift_price}, доступно: {userbot_balance})")
-        
-        config = await get_valid_config(session_user_id)
-        config["USERBOT"]["ENABLED"] = False
-        await save_config(config, user_id=session_user_id)
-
-        return False
-
-    client: Client = await get_userbot_client(session_user_id)
-    if not client:
+    if not get_accounts(session_user_id):
         logger.error("Не удалось получить объект клиента userbot.")
         return False
 
     for attempt in range(1, retries + 1):
+        candidates = _purchase_candidates(session_user_id)
+        if not candidates:
+            # Все аккаунты отключены или переподключаются — это не нехватка звёзд, конфиг не трогаем
+            logger.error(f"Нет доступных аккаунтов юзербота для покупки подарка {gift_id}")
+            return False
+
+        account, ledger = await _reserve_account(session_user_id, candidates, gift_price)
+        if account is None:
+            logger.error(f"Недостаточно звёзд для покупки подарка {gift_id} (требуется: {gift_price}) ни на одном аккаунте юзербота")
+
+            await update_config(session_user_id, set_fields={"USERBOT.ENABLED": False})
+
+            return False
+
+        committed = False
+        account.in_flight += 1
         try:
-            logger.debug(f"Попытка {attempt}/{retries} покупки подарка юзерботом...")
+            await account.limiter.acquire()
+            logger.debug(f"Попытка {attempt}/{retries} покупки подарка юзерботом {account.name}...")
 
             if target_user_id and not target_chat_id:
-                result_send: Message = await client.send_gift(gift_id=int(gift_id), 
-                                                         chat_id=int(target_user_id), 
-                                                         is_private=True)
+                result_send: Message = await account.client.send_gift(gift_id=int(gift_id), 
+                                                                      chat_id=get_userbot_peer(account.name, int(target_user_id)), 
+                                                                      is_private=True)
             elif target_chat_id and not target_user_id:
-                result_send: Message = await client.send_gift(gift_id=int(gift_id), 
-                                                         chat_id=target_chat_id, 
-                                                         is_private=True)
+                result_send: Message = await account.client.send_gift(gift_id=int(gift_id), 
+                                                                      chat_id=get_userbot_peer(account.name, target_chat_id), 
+                                                                      is_private=True)
             else:
                 logger.warning("Указаны оба параметра — target_user_id и target_chat_id. Прерываем.")
                 break
 
-            new_balance = await change_balance_userbot(-gift_price, user_id=session_user_id)
-            logger.info(f"Успешная покупка подарка {gift_id} за {gift_price} звёзд. Остаток: {new_balance}")
+            account.limiter.on_success()
+            account.sent += 1
+            new_balance = ledger.commit(gift_price)
+            committed = True
+            record_purchase(gift_id)
+            logger.info(f"Успешная покупка подарка {gift_id} за {gift_price} звёзд через {account.name}. Остаток: {new_balance}")
             return True
-        
+
         except FloodWait as e:
-            logger.error(f"Flood wait: ждём {e.retry_after} секунд")
-            await asyncio.sleep(e.value)
+            # Аккаунт уходит на паузу, следующая попытка — через другой аккаунт пула
+            logger.error(f"Flood wait на {account.name}: ждём {e.value} секунд")
+            account.on_flood_wait(e.value)
 
         except BadRequest as e:
             if "BALANCE_TOO_LOW" in str(e) or "not enough" in str(e).lower():
@@ -100,10 +117,20 @@ async def buy_gift_userbot(
         except Forbidden as e:
             logger.error(f"(Forbidden) Критическая ошибка: {e}")
             return False
-        
+
         except AuthKeyUnregistered as e:
-            logger.error(f"(AuthKeyUnregistered) Критическая ошибка: {e}")
-            return False
+            logger.error(f"(AuthKeyUnregistered) Аккаунт {account.name} выведен из пула: {e}")
+            account.set_healthy(False)
+
+        except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+            # Сессия отвалилась — без паузы пробуем другой аккаунт, этот переподключит супервизор
+            logger.error(f"Аккаунт {account.name} потерял соединение: {e}")
+            account.mark_disconnected(str(e) or type(e).__name__)
+
+        except StargiftUsageLimited:
+            logger.warning(f"Подарок {gift_id} распродан")
+            mark_exhausted(gift_id)
+            return SOLD_OUT
 
         except RPCError as e:
             logger.error(f"RPC ошибка: {e}")
@@ -114,5 +141,69 @@ async def buy_gift_userbot(
             logger.error(f"[{attempt}/{retries}] Ошибка userbot при покупке: {e}. Повтор через {delay} сек...")
             await asyncio.sleep(delay)
 
+        finally:
+            account.in_flight -= 1
+            # Покупка не прошла — возвращаем резерв в доступные звёзды
+            if not committed:
+                ledger.release(gift_price)
+
     logger.error(f"Не удалось купить подарок {gift_id} после {retries} попыток.")
     return False
+
+
+async def buy_gifts_userbot_batch(
+    session_user_id: int,
+    gift_id: int,
+    target_user_id: int,
+    target_chat_id: str,
+    gift_price: int,
+    quantity: int,
+    concurrency: int = PURCHASE_PIPELINE_DEPTH
+) -> dict:
+    """
+    Покупает quantity одинаковых подарков юзерботом конвейером из concurrency запросов.
+    Покупки распределяются по аккаунтам пула; после первой неудачи новые не запускаются.
+
+    :param session_user_id: ID сессии юзербота
+    :param gift_id: ID подарка
+    :param target_user_id: ID получателя-пользователя (или None)
+    :param target_chat_id: ID получателя-чата (или None)
+    :param gift_price: Стоимость подарка в звёздах
+    :param quantity: Количество подарков
+    :param concurrency: Максимум одновременных покупок
+    :return: Словарь run_batch: результаты по каждому подарку и итоги (bought, failed, skipped, spent)
+    """
+    return await run_batch(
+        lambda: buy_gift_userbot(session_user_id, gift_id, target_user_id, target_chat_id, gift_price),
+        quantity,
+        gift_price,
+        concurrency
+    )
+
+
+def _purchase_candidates(owner_id: int) -> list[UserbotAccount]:
+    """
+    Возвращает аккаунты пула, через которые можно отправить покупку, от наименее загруженного.
+    Если все аккаунты на паузе после FloodWait, берутся здоровые — их лимитер дождётся паузы.
+    Пустой список — ни одного здорового аккаунта.
+    """
+    candidates = get_available_accounts(owner_id)
+    if not candidates:
+        candidates = sorted(
+            (a for a in get_accounts(owner_id) if a.healthy),
+            key=lambda a: (a.in_flight, a.sent)
+        )
+    return candidates
+
+
+async def _reserve_account(owner_id: int, candidates: list[UserbotAccount], gift_price: int) -> tuple[UserbotAccount | None, object]:
+    """
+    Выбирает первый из candidates аккаунт, у которого хватает звёзд, и резервирует цену подарка.
+
+    :return: (аккаунт, леджер) или (None, None), если звёзд не хватает ни на одном аккаунте
+    """
+    for account in candidates:
+        ledger = await get_ledger(owner_id, account.account)
+        if ledger.reserve(gift_price):
+            return account, ledger
+    return None, None
@@ -0,0 +1,325 @@
+# --- Стандартные библиотеки ---
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import count
+from typing import NamedTuple
+import time
+
+# --- Внутренние модули ---
+from services.config import CATALOG_REGISTRY_SIZE
+
+
+class GiftRecord(NamedTuple):
+    """
+    Неизменяемая запись о подарке каталога.
+
+    Записи общие для всех снимков: gift_record возвращает уже существующую запись,
+    если цена, тираж и остаток подарка не изменились, поэтому повторные опросы каталога
+    не создают новых объектов, а снимки ссылаются на одни и те же записи.
+    """
+    id: int | str
+    price: int
+    supply: int | None
+    left: int | None
+    sticker_file_id: str | None
+    emoji: str | None
+
+    def as_dict(self) -> dict:
+        """
+        Словарь для хендлеров и состояния FSM.
+        """
+        return self._asdict()
+
+
+_gift_records: dict = {}  # Последняя запись по id подарка
+
+
+def gift_record(gift_id, price, supply, left, sticker_file_id=None, emoji=None) -> GiftRecord:
+    """
+    Возвращает запись о подарке, переиспользуя существующую, если совпадают цена, тираж и остаток.
+    Стикер сравнивается только на наличие: Bot API и Pyrogram отдают для одного подарка
+    разные file_id, и иначе опросы двух источников по очереди пересоздавали бы запись.
+
+    :param gift_id: ID подарка
+    :param price: Цена в звёздах
+    :param supply: Общий тираж (None — не лимитированный подарок)
+    :param left: Остаток
+    :param sticker_file_id: file_id стикера
+    :param emoji: Эмодзи стикера
+    """
+    record = _gift_records.get(gift_id)
+    if record is not None and (record.price, record.supply, record.left) == (price, supply, left):
+        if (record.sticker_file_id or not sticker_file_id) and (record.emoji or not emoji):
+            return record
+    if record is not None:
+        sticker_file_id = record.sticker_file_id or sticker_file_id
+        emoji = record.emoji or emoji
+    record = GiftRecord(gift_id, price, supply, left, sticker_file_id, emoji)
+    _gift_records[gift_id] = record
+    return record
+
+
+def gift_from_dict(gift: dict) -> GiftRecord:
+    """
+    Запись о подарке из словаря (тестовые подарки, данные из состояния FSM).
+    """
+    return gift_record(
+        gift.get("id"),
+        gift.get("price"),
+        gift.get("supply"),
+        gift.get("left"),
+        gift.get("sticker_file_id"),
+        gift.get("emoji")
+    )
+
+
+_local_left: dict = {}  # id подарка → остаток с учётом наших покупок (0 — распродан по ответу Telegram)
+
+
+def gift_left(gift: GiftRecord) -> int | None:
+    """
+    Возвращает остаток лимитированного подарка: наблюдаемый в каталоге,
+    уменьшенный нашими покупками после наблюдения. None — подарок не лимитированный.
+    """
+    if not gift.supply or gift.left is None:
+        return None
+    local = _local_left.get(gift.id)
+    return gift.left if local is None else min(gift.left, local)
+
+
+def is_gift_available(gift: GiftRecord) -> bool:
+    """
+    Проверяет, можно ли ещё купить подарок (не лимитированный или остаток больше нуля).
+    """
+    left = gift_left(gift)
+    return left is None or left > 0
+
+
+def record_purchase(gift_id, count: int = 1) -> None:
+    """
+    Уменьшает локальный остаток подарка после нашей успешной покупки,
+    не дожидаясь следующего опроса каталога.
+    """
+    gift_id = str(gift_id)
+    gift = _gift_records.get(gift_id)
+    if gift is None:
+        return
+    left = gift_left(gift)
+    if left is not None:
+        _local_left[gift_id] = max(0, left - count)
+
+
+def mark_exhausted(gift_id) -> None:
+    """
+    Помечает подарок распроданным (Telegram ответил STARGIFT_USAGE_LIMITED).
+    Остаток лимитированного подарка не растёт, поэтому отметка не снимается.
+    """
+    _local_left[str(gift_id)] = 0
+
+
+class _SoldOut:
+    """
+    Результат покупки «подарок распродан»: ложный, как неудачная покупка,
+    но вызывающий код может отличить его (result is SOLD_OUT) и не считать ошибкой.
+    """
+    __slots__ = ()
+
+    def __bool__(self) -> bool:
+        return False
+
+    def __repr__(self) -> str:
+        return "SOLD_OUT"
+
+
+SOLD_OUT = _SoldOut()
+
+
+class CatalogSnapshot:
+    """
+    Неизменяемый снимок каталога подарков.
+
+    Подарки хранятся отсортированными по цене (по убыванию, как их отдают фильтры),
+    диапазон цен выбирается бинарным поиском, а supply проверяется только у кандидатов.
+    Результаты выборок запоминаются внутри снимка: профили с одинаковыми параметрами
+    получают готовый список без повторного сканирования и сортировки.
+    Распроданные подарки (см. is_gift_available) в выборки не попадают.
+    """
+    __slots__ = ("_gifts", "_keys", "_by_id", "_queries", "_observed", "source", "created_at", "snapshot_id")
+
+    def __init__(
+        self,
+        gifts=(),
+        source: str = "bot",
+        created_at: float | None = None,
+        observed: dict | None = None
+    ):
+        """
+        :param gifts: Записи о подарках (GiftRecord)
+        :param source: Источник снимка ("bot" или "userbot")
+        :param created_at: Время получения данных (time.time()), по умолчанию — текущее
+        :param observed: Для объединённых снимков — id подарка → (источник, время наблюдения)
+        """
+        # Устойчивая сортировка: подарки с одной ценой сохраняют порядок из API
+        ordered = sorted(gifts, key=lambda g: -(g.price or 0))
+        self._gifts = tuple(ordered)
+        self._keys = [-(g.price or 0) for g in ordered]
+        self._by_id = {g.id: g for g in ordered}
+        self._queries = {}
+        self._observed = observed
+        self.source = source
+        self.created_at = time.time() if created_at is None else created_at
+        self.snapshot_id: str | None = None  # Присваивается при remember_snapshot
+
+    def __len__(self) -> int:
+        return len(self._gifts)
+
+    def __iter__(self):
+        return iter(self._gifts)
+
+    def __contains__(self, gift_id) -> bool:
+        return gift_id in self._by_id
+
+    def get(self, gift_id) -> GiftRecord | None:
+        """
+        Возвращает подарок по id или None.
+        """
+        return self._by_id.get(gift_id)
+
+    def observation(self, gift_id) -> tuple[str, float]:
+        """
+        Возвращает источник и время наблюдения подарка (для объединённых снимков — по каждому подарку).
+        """
+        if self._observed is not None and str(gift_id) in self._observed:
+            return self._observed[str(gift_id)]
+        return self.source, self.created_at
+
+    def select(
+        self,
+        min_price: int,
+        max_price: int,
+        min_supply: int = 0,
+        max_supply: int = 0,
+        unlimited: bool = False
+    ) -> list[GiftRecord]:
+        """
+        Выбирает подарки по диапазону цены и supply.
+
+        :param min_price: Минимальная цена подарка
+        :param max_price: Максимальная цена подарка
+        :param min_supply: Минимальный supply подарка
+        :param max_supply: Максимальный supply подарка
+        :param unlimited: Если True — supply не проверяется
+        :return: Список доступных подарков, отсортированный по цене по убыванию
+        """
+        key = (min_price, max_price, min_supply, max_supply, unlimited)
+        cached = self._queries.get(key)
+        if cached is None:
+            lo = bisect_left(self._keys, -max_price)
+            hi = bisect_right(self._keys, -min_price)
+            candidates = self._gifts[lo:hi]
+            if unlimited:
+                cached = candidates
+            else:
+                cached = tuple(
+                    g for g in candidates
+                    if min_supply <= (g.supply or 0) <= max_supply
+                )
+            self._queries[key] = cached
+        # Остатки меняются после наших покупок, поэтому проверяются при каждой выборке
+        return [g for g in cached if is_gift_available(g)]
+
+    def select_for_profile(self, profile: dict) -> list[GiftRecord]:
+        """
+        Выбирает подарки, подходящие под параметры профиля.
+        """
+        return self.select(
+            profile["MIN_PRICE"],
+            profile["MAX_PRICE"],
+            profile["MIN_SUPPLY"],
+            profile["MAX_SUPPLY"]
+        )
+
+
+def merge_catalogs(*snapshots: CatalogSnapshot, source: str = "merged") -> CatalogSnapshot:
+    """
+    Объединяет снимки разных источников по id подарка.
+
+    Для каждого подарка остаётся наблюдение из самого свежего снимка, в котором он есть;
+    источник и время наблюдения доступны через CatalogSnapshot.observation.
+    Подарок, который видел только один источник, тоже попадает в результат.
+    Bot API отдаёт id строкой, Pyrogram — числом, поэтому подарки сопоставляются по str(id).
+
+    :param snapshots: Снимки каталога (пустые допускаются)
+    :param source: Источник итогового снимка
+    :return: Объединённый снимок, created_at — время самого свежего из входных снимков
+    """
+    merged = {}
+    observed = {}
+    # От старых к свежим: более свежее наблюдение перезаписывает предыдущее
+    for snapshot in sorted(snapshots, key=lambda s: s.created_at):
+        for gift in snapshot:
+            key = str(gift.id)
+            merged[key] = gift
+            observed[key] = snapshot.observation(gift.id)
+    created_at = max((s.created_at for s in snapshots), default=None)
+    return CatalogSnapshot(merged.values(), source=source, created_at=created_at, observed=observed)
+
+
+_registry: "OrderedDict[str, CatalogSnapshot]" = OrderedDict()  # Снимки, на которые ссылаются состояния FSM
+_snapshot_ids = count(1)
+
+
+def remember_snapshot(snapshot: CatalogSnapshot) -> str:
+    """
+    Сохраняет снимок в ограниченном реестре и возвращает его id для хранения в состоянии FSM
+    вместо копии каталога. Один и тот же снимок получает один id, сколько бы пользователей
+    ни открыли каталог; самые старые снимки вытесняются после CATALOG_REGISTRY_SIZE.
+    """
+    if snapshot.snapshot_id is None:
+        snapshot.snapshot_id = f"{snapshot.source}-{next(_snapshot_ids)}"
+    _registry[snapshot.snapshot_id] = snapshot
+    _registry.move_to_end(snapshot.snapshot_id)
+    while len(_registry) > CATALOG_REGISTRY_SIZE:
+        _registry.popitem(last=False)
+    return snapshot.snapshot_id
+
+
+def find_snapshot(snapshot_id: str | None) -> CatalogSnapshot | None:
+    """
+    Возвращает снимок по id или None, если он вытеснен или процесс перезапускался.
+    """
+    if snapshot_id is None:
+        return None
+    return _registry.get(snapshot_id)
+
+
+class CatalogDiff(NamedTuple):
+    """
+    Разница между двумя снимками каталога.
+    """
+    added: tuple  # Подарки, которых не было в предыдущем снимке
+    removed: tuple  # Подарки, пропавшие из каталога
+    changed: tuple  # Подарки, у которых изменился остаток (left)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+
+def diff_catalogs(previous: CatalogSnapshot, current: CatalogSnapshot) -> CatalogDiff:
+    """
+    Сравнивает два снимка каталога по id подарков.
+
+    :param previous: Предыдущий снимок
+    :param current: Новый снимок
+    :return: Добавленные, удалённые и изменившие остаток подарки
+    """
+    added = []
+    changed = []
+    for gift in current:
+        old = previous.get(gift.id)
+        if old is None:
+            added.append(gift)
+        elif old.left != gift.left:
+            changed.append(gift)
+    removed = [gift for gift in previous if gift.id not in current]
+    return CatalogDiff(tuple(added), tuple(removed), tuple(changed))
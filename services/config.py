@@ -1,7 +1,10 @@
 # --- Стандартные библиотеки ---
 import os
+import copy
 import json
 import logging
+import time
+from collections import OrderedDict
 from typing import Optional
 
 logger = logging.getLogger(__name__)
@@ -12,8 +15,37 @@ VERSION = '1.3.0'
 CONFIG_PATH = "config.json"
 DEV_MODE = False # Покупка тестовых подарков
 MAX_PROFILES = 3 # Максимальная длина сообщения 4096 символов
-PURCHASE_COOLDOWN = 0.3 # Количество покупок в секунду
-USERBOT_UPDATE_COOLDOWN = 50 # Базовая величина ожидания в секундах для запроса списка подарков через юзербот
+PURCHASE_RATE = 3 # Средняя скорость покупок одного отправителя (покупок в секунду)
+PURCHASE_BURST = 10 # Сколько покупок одного отправителя можно отправить подряд без пауз
+PURCHASE_PIPELINE_DEPTH = 5 # Сколько покупок пакета отправляется одновременно (в пределах лимитера)
+LEDGER_FLUSH_INTERVAL = 2 # Через сколько секунд после покупки списания из памяти пачкой пишутся в MongoDB
+REFUND_PLAN_TIME_BUDGET = 2 # Максимальное время подбора депозитов для возврата звёзд в секундах
+REFUND_PLAN_MEMORY_LIMIT = 64 * 1024 * 1024 # Максимальный объём битовых масок при подборе депозитов для возврата (байт), выше — жадный вариант
+REFUND_CONCURRENCY = 5 # Сколько возвратов звёзд выполняется параллельно
+REFUND_RETRIES = 3 # Количество попыток возврата одной транзакции
+REFUND_PROGRESS_STEP = 10 # Через сколько выполненных возвратов сообщать пользователю о прогрессе
+USERBOT_UPDATE_COOLDOWN = 20 # Базовая величина ожидания в секундах для запроса списка подарков через юзербот
+USERBOT_UPDATE_MIN_INTERVAL = 3 # Минимальный интервал опроса каталога юзерботом (после изменений / перед дропом)
+USERBOT_PING_INTERVAL = 30 # Интервал проверки соединения аккаунтов юзербота (ping) в секундах
+USERBOT_PING_TIMEOUT = 10 # Сколько секунд ждать ответа на ping, прежде чем считать соединение потерянным
+USERBOT_RECONNECT_MAX_DELAY = 300 # Максимальная пауза между попытками переподключения аккаунта юзербота
+RECIPIENT_REFRESH_INTERVAL = 600 # Интервал фонового обновления разрешённых получателей профилей в секундах
+BOT_CATALOG_MIN_INTERVAL = 1 # Минимальный интервал опроса каталога ботом
+BOT_CATALOG_MAX_INTERVAL = 10 # Максимальный интервал опроса каталога ботом при стабильном каталоге
+BOT_CATALOG_IDLE_INTERVAL = 600 # Интервал опроса каталога ботом, когда в процессе нет запущенных воркеров и каталог никто не запрашивает
+CATALOG_BOOST_DURATION = 120 # Сколько секунд опрашивать каталог часто после замеченного изменения
+ENGINE_MAX_CONCURRENT_OWNERS = 20 # Сколько владельцев одновременно выполняют проход покупок, остальные ждут очереди
+ENGINE_DISCOVERY_INTERVAL = 60 # Как часто движок покупок ищет новых активных владельцев в MongoDB (секунд)
+WORKER_ACTIVE_TIMEOUT = 30 # Максимальная пауза активного воркера без событий (страховка, события приходят от опросчиков каталога)
+BOT_CATALOG_WAIT = 5 # Сколько секунд ждать первый снимок каталога бота после старта, прежде чем отдать пустой каталог
+CONFIG_CACHE_SIZE = 1000 # Максимальное количество конфигов, одновременно хранящихся в памяти
+FSM_STATE_TTL = 86400 # Через сколько секунд без изменений состояние мастера (FSM) удаляется из MongoDB
+CATALOG_REGISTRY_SIZE = 16 # Сколько снимков каталога хранится для открытых пользователями каталогов
+SHARDED_CONFIG_CACHE_TTL = 5 # Время жизни конфига в кеше при нескольких процессах-воркерах (конфиг меняют и другие процессы)
+LEASE_TTL = 30 # Время аренды владельца процессом-воркером в секундах
+LEASE_RENEW_INTERVAL = 10 # Интервал продления аренды владельцев (heartbeat) в секундах
+LEASE_SAFETY_MARGIN = 5 # За сколько секунд до окончания непродлённой аренды процесс перестаёт начинать покупки
+ORDER_RECLAIM_TIMEOUT = 600 # Через сколько секунд заказ на покупку, начатый другим процессом, считается брошенным и выполняется заново
 ALLOWED_USER_IDS = []
 
 def add_allowed_user(user_id):
@@ -52,10 +84,21 @@ def DEFAULT_CONFIG(user_id: int) -> dict:
             "USER_ID": None,
             "USERNAME": None,
             "BALANCE": 0,
-            "ENABLED": False
+            "ENABLED": False,
+            "ACCOUNTS": []
         }
     }
 
+# Типы полей дополнительных аккаунтов юзербота (USERBOT.ACCOUNTS),
+# которые используют API_ID/API_HASH основного аккаунта и свои файлы сессий
+USERBOT_ACCOUNT_TYPES = {
+    "SESSION": (str, False),
+    "PHONE": (str, True),
+    "USER_ID": (int, True),
+    "USERNAME": (str, True),
+    "BALANCE": (int, False),
+}
+
 # Типы и требования для каждого поля профиля
 PROFILE_TYPES = {
     "NAME": (str, True),
@@ -94,11 +137,71 @@ def is_valid_type(value, expected_type, allow_none=False):
 
 
 from services.db import get_configs_collection
+from services.events import notify_worker
+from pymongo import ReturnDocument
 import aiofiles
 
 
+# ------------- Кеш конфигов -----------------------
+
+# LRU-кеш конфигов по user_id. Запись сквозная: save_config сначала пишет в MongoDB,
+# затем обновляет кеш. Кеш локален для процесса — при изменении документа в обход
+# save_config нужно вызвать invalidate_config_cache.
+_config_cache: "OrderedDict[int, dict]" = OrderedDict()
+_config_cache_times: dict[int, float] = {}  # time.monotonic() записи в кеш по user_id
+_config_cache_ttl: Optional[float] = None  # None — записи не устаревают (один процесс)
+
+
+def set_config_cache_ttl(ttl: Optional[float]):
+    """
+    Задаёт время жизни записей кеша. Нужно, когда конфиги меняют несколько процессов.
+    """
+    global _config_cache_ttl
+    _config_cache_ttl = ttl
+
+
+def _cache_get(user_id: int) -> Optional[dict]:
+    """
+    Возвращает копию конфига из кеша или None, если записи нет.
+    """
+    config = _config_cache.get(user_id)
+    if config is None:
+        return None
+    if _config_cache_ttl is not None and time.monotonic() - _config_cache_times.get(user_id, 0) > _config_cache_ttl:
+        invalidate_config_cache(user_id)
+        return None
+    _config_cache.move_to_end(user_id)
+    return copy.deepcopy(config)
+
+
+def _cache_put(user_id: int, config: dict):
+    """
+    Кладёт копию конфига в кеш, вытесняя самые старые записи при переполнении.
+    """
+    _config_cache[user_id] = copy.deepcopy(config)
+    _config_cache_times[user_id] = time.monotonic()
+    _config_cache.move_to_end(user_id)
+    while len(_config_cache) > CONFIG_CACHE_SIZE:
+        evicted, _ = _config_cache.popitem(last=False)
+        _config_cache_times.pop(evicted, None)
+
+
+def invalidate_config_cache(user_id: Optional[int] = None):
+    """
+    Сбрасывает кеш конфига пользователя (или весь кеш, если user_id не задан).
+    """
+    if user_id is None:
+        _config_cache.clear()
+        _config_cache_times.clear()
+    else:
+        _config_cache.pop(user_id, None)
+        _config_cache_times.pop(user_id, None)
+
+
 async def ensure_config(user_id: int, path: str = CONFIG_PATH):
     """Гарантирует существование записи конфигурации в MongoDB для указанного user_id."""
+    if user_id in _config_cache:
+        return
     col = get_configs_collection()
     existing = await col.find_one({"_id": user_id})
     if existing is None:
@@ -119,16 +222,20 @@ async def ensure_config(user_id: int, path: str = CONFIG_PATH):
         # Храним user_id в _id для уникальности
         doc["_id"] = user_id
         await col.insert_one(doc)
+        _cache_put(user_id, {k: v for k, v in doc.items() if k != "_id"})
         logger.info("Создана конфигурация в MongoDB для user_id=%s", user_id)
 
 
 async def load_config(user_id: Optional[int] = None, path: str = CONFIG_PATH) -> dict:
-    """Загружает конфиг пользователя из MongoDB. Если user_id не задан, берётся из окружения."""
+    """Загружает конфиг пользователя (из кеша или MongoDB). Если user_id не задан, берётся из окружения."""
     if user_id is None:
         env_user = os.getenv("TELEGRAM_USER_ID")
         if not env_user:
             raise RuntimeError("TELEGRAM_USER_ID не задан и user_id не передан")
         user_id = int(env_user)
+    cached = _cache_get(user_id)
+    if cached is not None:
+        return cached
     col = get_configs_collection()
     doc = await col.find_one({"_id": user_id})
     if not doc:
@@ -138,6 +245,8 @@ async def load_config(user_id: Optional[int] = None, path: str = CONFIG_PATH) ->
     # Удаляем служебное поле перед возвратом
     if doc and "_id" in doc:
         doc = {k: v for k, v in doc.items() if k != "_id"}
+    if doc:
+        _cache_put(user_id, doc)
     return doc or {}
 
 
@@ -145,6 +254,7 @@ async def save_config(config: dict, user_id: Optional[int] = None, path: str = C
     """Сохраняет конфиг пользователя в MongoDB. user_id обязателен для многопользовательского режима.
 
     Если user_id не передан, будет использован TELEGRAM_USER_ID из окружения (для обратной совместимости).
+    Счётчики баланса и покупок не перезаписываются (см. _config_save_fields) — их меняет только update_config.
     """
     if user_id is None:
         env_user = os.getenv("TELEGRAM_USER_ID")
@@ -152,14 +262,207 @@ async def save_config(config: dict, user_id: Optional[int] = None, path: str = C
             raise RuntimeError("TELEGRAM_USER_ID не задан для сохранения конфига и user_id не передан")
         user_id = int(env_user)
     col = get_configs_collection()
-    # Не допустим утечки служебного поля
-    config_to_save = dict(config)
-    if "_id" in config_to_save:
-        del config_to_save["_id"]
-    await col.update_one({"_id": user_id}, {"$set": config_to_save}, upsert=True)
+    doc = await col.find_one_and_update(
+        {"_id": user_id},
+        [{"$set": _config_save_fields(config)}],
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    _cache_put(user_id, {k: v for k, v in doc.items() if k != "_id"})
+    notify_worker(user_id, reason="config")
     logger.info("Конфигурация сохранена в MongoDB для user_id=%s", user_id)
 
 
+def _stored_counter(stored, value) -> dict:
+    """
+    Выражение pipeline для счётчика: значение из базы, если это целое число, иначе value.
+    """
+    return {"$cond": [{"$in": [{"$type": stored}, ["int", "long"]]}, stored, {"$literal": value}]}
+
+
+def _merge_counters(stored, item: dict, counters: tuple) -> dict:
+    """
+    Выражение pipeline для элемента списка (профиля или аккаунта): поля из item,
+    счётчики counters — из сохранённого в базе элемента stored (см. _stored_counter).
+    """
+    return {"$let": {
+        "vars": {"old": stored},
+        "in": {"$mergeObjects": [
+            {"$literal": item},
+            {key: _stored_counter(f"$$old.{key}", item.get(key, 0)) for key in counters}
+        ]}
+    }}
+
+
+def _config_save_fields(config: dict) -> dict:
+    """
+    Поля pipeline-обновления для save_config.
+
+    Счётчики, которые параллельно меняют покупки и баланс через update_config (BALANCE,
+    USERBOT.BALANCE, USERBOT.ACCOUNTS.i.BALANCE, PROFILES.i.BOUGHT/SPENT), берутся из базы,
+    а из переданного конфига — только если в базе их нет или значение некорректно.
+    Профили сопоставляются по индексу, поэтому добавление и удаление профилей
+    выполняются отдельно (add_profile, remove_profile); аккаунты — по имени сессии.
+    """
+    fields = {}
+    for key, value in config.items():
+        if key in ("_id", "BALANCE", "USERBOT", "PROFILES"):
+            continue
+        fields[key] = {"$literal": value}
+    if "BALANCE" in config:
+        fields["BALANCE"] = _stored_counter("$BALANCE", config["BALANCE"])
+    for key, value in config.get("USERBOT", {}).items():
+        if key == "BALANCE":
+            fields["USERBOT.BALANCE"] = _stored_counter("$USERBOT.BALANCE", value)
+        elif key == "ACCOUNTS":
+            stored_accounts = {"$ifNull": ["$USERBOT.ACCOUNTS", []]}
+            fields["USERBOT.ACCOUNTS"] = [
+                _merge_counters(
+                    {"$arrayElemAt": [
+                        {"$filter": {
+                            "input": stored_accounts,
+                            "as": "account",
+                            "cond": {"$eq": ["$$account.SESSION", {"$literal": account.get("SESSION")}]}
+                        }},
+                        0
+                    ]},
+                    account,
+                    ("BALANCE",)
+                )
+                for account in value
+            ]
+        else:
+            fields[f"USERBOT.{key}"] = {"$literal": value}
+    if "PROFILES" in config:
+        stored_profiles = {"$ifNull": ["$PROFILES", []]}
+        fields["PROFILES"] = [
+            _merge_counters({"$arrayElemAt": [stored_profiles, index]}, profile, ("BOUGHT", "SPENT"))
+            for index, profile in enumerate(config["PROFILES"])
+        ]
+    return fields
+
+
+async def get_active_owner_ids() -> list[int]:
+    """
+    Возвращает user_id всех владельцев с включёнными покупками (ACTIVE=True).
+    """
+    col = get_configs_collection()
+    docs = await col.find({"ACTIVE": True}, {"_id": 1}).to_list(length=None)
+    return [doc["_id"] for doc in docs]
+
+
+async def is_owner_active(user_id: int) -> bool:
+    """
+    Читает ACTIVE владельца напрямую из MongoDB, минуя кеш конфигов.
+    Нужна при нескольких процессах: покупки могут выключить в другом процессе.
+    """
+    col = get_configs_collection()
+    doc = await col.find_one({"_id": user_id}, {"ACTIVE": 1})
+    return bool(doc and doc.get("ACTIVE"))
+
+
+# ------------- Точечные обновления ---------------
+
+
+def profile_field(index: int, field: str) -> str:
+    """
+    Возвращает путь к полю профиля для точечного обновления, например "PROFILES.0.BOUGHT".
+    """
+    return f"PROFILES.{index}.{field}"
+
+
+def userbot_account_field(index: int, field: str) -> str:
+    """
+    Возвращает путь к полю дополнительного аккаунта юзербота, например "USERBOT.ACCOUNTS.0.BALANCE".
+    """
+    return f"USERBOT.ACCOUNTS.{index}.{field}"
+
+
+def _field_type(path: str) -> tuple:
+    """
+    Определяет (тип, допускается_ли_None) для пути к полю конфига.
+    Бросает ValueError для неизвестных путей.
+    """
+    parts = path.split(".")
+    if len(parts) == 1 and parts[0] in CONFIG_TYPES:
+        return CONFIG_TYPES[parts[0]]
+    if len(parts) == 3 and parts[0] == "PROFILES" and parts[1].isdigit() and parts[2] in PROFILE_TYPES:
+        return PROFILE_TYPES[parts[2]]
+    if len(parts) == 2 and parts[0] == "USERBOT" and parts[1] in DEFAULT_CONFIG(0)["USERBOT"]:
+        if parts[1] == "ACCOUNTS":
+            return (list, False)
+        return (int, False) if parts[1] == "BALANCE" else (object, True)
+    if (
+        len(parts) == 4 and parts[:2] == ["USERBOT", "ACCOUNTS"]
+        and parts[2].isdigit() and parts[3] in USERBOT_ACCOUNT_TYPES
+    ):
+        return USERBOT_ACCOUNT_TYPES[parts[3]]
+    raise ValueError(f"Неизвестное поле конфига: {path}")
+
+
+async def update_config(
+    user_id: Optional[int],
+    inc: Optional[dict] = None,
+    set_fields: Optional[dict] = None,
+    max_fields: Optional[dict] = None,
+    notify: bool = False
+) -> dict:
+    """
+    Атомарно изменяет отдельные поля конфига, не перезаписывая весь документ.
+
+    :param user_id: Telegram ID владельца конфига (если None — берётся TELEGRAM_USER_ID)
+    :param inc: Приращения для $inc, например {"PROFILES.0.BOUGHT": 1, "BALANCE": -15}
+    :param set_fields: Значения для $set, например {"ACTIVE": False}
+    :param max_fields: Нижние границы для $max, например {"BALANCE": 0}
+    :param notify: Разбудить воркер покупок после изменения (для действий пользователя)
+    :return: Актуальный конфиг после обновления
+    """
+    update = {}
+    for op, fields in (("$inc", inc), ("$set", set_fields), ("$max", max_fields)):
+        if not fields:
+            continue
+        for path, value in fields.items():
+            expected_type, allow_none = _field_type(path)
+            if op != "$set" and expected_type is not int:
+                raise ValueError(f"Поле {path} не числовое, {op} недопустим")
+            if not is_valid_type(value, expected_type, allow_none and op == "$set"):
+                raise ValueError(f"Недопустимое значение {value!r} для поля {path}")
+        update[op] = fields
+    if user_id is None:
+        env_user = os.getenv("TELEGRAM_USER_ID")
+        if not env_user:
+            raise RuntimeError("TELEGRAM_USER_ID не задан для обновления конфига и user_id не передан")
+        user_id = int(env_user)
+    if not update:
+        return await load_config(user_id)
+
+    col = get_configs_collection()
+    doc = await col.find_one_and_update({"_id": user_id}, update, return_document=ReturnDocument.AFTER)
+    if doc is None:
+        invalidate_config_cache(user_id)
+        await ensure_config(user_id)
+        doc = await col.find_one_and_update({"_id": user_id}, update, return_document=ReturnDocument.AFTER)
+    config = {k: v for k, v in (doc or {}).items() if k != "_id"}
+    _cache_put(user_id, config)
+    if notify:
+        notify_worker(user_id, reason="config")
+    logger.debug("Конфигурация user_id=%s обновлена: %s", user_id, update)
+    return config
+
+
+async def increment_profile_stats(user_id: int, index: int, bought: int = 0, spent: int = 0) -> dict:
+    """
+    Атомарно увеличивает счётчики BOUGHT и SPENT профиля.
+
+    :return: Обновлённый профиль
+    """
+    config = await update_config(user_id, inc={
+        profile_field(index, "BOUGHT"): bought,
+        profile_field(index, "SPENT"): spent,
+    })
+    return config["PROFILES"][index]
+
+
 async def validate_profile(profile: dict, user_id: Optional[int] = None) -> dict:
     """
     Валидирует один профиль.
@@ -208,7 +511,10 @@ async def validate_config(config: dict, user_id: int) -> dict:
 
 
 async def get_valid_config(user_id: int, path: str = CONFIG_PATH) -> dict:
-    """Загружает, валидирует и при необходимости обновляет конфигурацию в MongoDB."""
+    """
+    Загружает, валидирует и при необходимости обновляет конфигурацию в MongoDB.
+    Повторные вызовы обслуживаются из кеша без обращения к базе.
+    """
     await ensure_config(user_id, path)
     config = await load_config(user_id, path)
     validated = await validate_config(config, user_id)
@@ -251,6 +557,7 @@ async def migrate_config_if_needed(user_id: int, path: str = CONFIG_PATH):
         "PROFILES": [profile],
     }
     await col.update_one({"_id": user_id}, {"$set": new_config})
+    invalidate_config_cache(user_id)
     logger.info("Конфиг user_id=%s мигрирован в новый формат (MongoDB).", user_id)
 
 
@@ -267,25 +574,52 @@ async def get_profile(config: dict, index: int = 0) -> dict:
     return profiles[index]
 
 
+async def _update_profiles(config: dict, user_id: Optional[int], update) -> dict:
+    """
+    Атомарно меняет список профилей в MongoDB (счётчики остальных профилей не затрагиваются)
+    и обновляет переданный конфиг актуальной версией из базы.
+    """
+    if user_id is None:
+        env_user = os.getenv("TELEGRAM_USER_ID")
+        if not env_user:
+            raise RuntimeError("TELEGRAM_USER_ID не задан для обновления конфига и user_id не передан")
+        user_id = int(env_user)
+    col = get_configs_collection()
+    doc = await col.find_one_and_update({"_id": user_id}, update, return_document=ReturnDocument.AFTER)
+    if doc is None:
+        raise ValueError("Конфиг не найден")
+    fresh = {k: v for k, v in doc.items() if k != "_id"}
+    _cache_put(user_id, fresh)
+    notify_worker(user_id, reason="config")
+    config.clear()
+    config.update(copy.deepcopy(fresh))
+    return config
+
+
 async def add_profile(config: dict, profile: dict, user_id: Optional[int] = None, save: bool = True) -> dict:
     """
     Добавляет новый профиль в конфиг.
     """
-    config.setdefault("PROFILES", []).append(profile)
-    if save:
-        await save_config(config, user_id=user_id)
-    return config
+    if not save:
+        config.setdefault("PROFILES", []).append(profile)
+        return config
+    return await _update_profiles(config, user_id, {"$push": {"PROFILES": profile}})
 
 
 async def update_profile(config: dict, index: int, new_profile: dict, user_id: Optional[int] = None, save: bool = True) -> dict:
     """
-    Обновляет профиль по индексу.
+    Обновляет профиль по индексу (счётчики задаются значениями из new_profile).
     """
     if "PROFILES" not in config or index >= len(config["PROFILES"]):
         raise IndexError("Профиль не найден")
-    config["PROFILES"][index] = new_profile
-    if save:
-        await save_config(config, user_id=user_id)
+    if not save:
+        config["PROFILES"][index] = new_profile
+        return config
+    # Профиль заменяется целиком, но отдельными полями: счётчики остальных профилей не перезаписываются
+    valid = await validate_profile(new_profile, user_id)
+    fields = {profile_field(index, key): value for key, value in valid.items()}
+    config.clear()
+    config.update(await update_config(user_id, set_fields=fields, notify=True))
     return config
 
 
@@ -295,13 +629,31 @@ async def remove_profile(config: dict, index: int, user_id: int, save: bool = Tr
     """
     if "PROFILES" not in config or index >= len(config["PROFILES"]):
         raise IndexError("Профиль не найден")
-    config["PROFILES"].pop(index)
-    if not config["PROFILES"]:
-        # Добавить дефолтный если удалили все
-        config["PROFILES"].append(DEFAULT_PROFILE(user_id))
-    if save:
-        await save_config(config, user_id=user_id)
-    return config
+    if not save:
+        config["PROFILES"].pop(index)
+        if not config["PROFILES"]:
+            # Добавить дефолтный если удалили все
+            config["PROFILES"].append(DEFAULT_PROFILE(user_id))
+        return config
+    # Вырезаем профиль на стороне MongoDB, чтобы не перезаписать счётчики остальных профилей
+    rest = {"$map": {
+        "input": {"$filter": {
+            "input": {"$range": [0, {"$size": "$PROFILES"}]},
+            "as": "i",
+            "cond": {"$ne": ["$$i", index]}
+        }},
+        "as": "i",
+        "in": {"$arrayElemAt": ["$PROFILES", "$$i"]}
+    }}
+    return await _update_profiles(config, user_id, [{"$set": {"PROFILES": {"$let": {
+        "vars": {"rest": rest},
+        "in": {"$cond": [
+            {"$eq": [{"$size": "$$rest"}, 0]},
+            # Добавить дефолтный если удалили все
+            {"$literal": [DEFAULT_PROFILE(user_id)]},
+            "$$rest"
+        ]}
+    }}}}])
 
 
 # ------------- Форматирование ---------------------
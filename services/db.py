@@ -28,3 +28,32 @@ def get_configs_collection() -> AsyncIOMotorCollection:
     return db["configs"]
 
 
+
+def get_star_transactions_collection() -> AsyncIOMotorCollection:
+    client = _get_client()
+    db = client[get_db_name()]
+    return db["star_transactions"]
+
+
+def get_star_sync_collection() -> AsyncIOMotorCollection:
+    client = _get_client()
+    db = client[get_db_name()]
+    return db["star_sync"]
+
+
+def get_worker_leases_collection() -> AsyncIOMotorCollection:
+    client = _get_client()
+    db = client[get_db_name()]
+    return db["worker_leases"]
+
+
+def get_fsm_collection() -> AsyncIOMotorCollection:
+    client = _get_client()
+    db = client[get_db_name()]
+    return db["fsm_states"]
+
+
+def get_purchase_orders_collection() -> AsyncIOMotorCollection:
+    client = _get_client()
+    db = client[get_db_name()]
+    return db["purchase_orders"]
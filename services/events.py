@@ -0,0 +1,146 @@
+# --- Стандартные библиотеки ---
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+_wakeups: dict[int, asyncio.Event] = {}  # Событие пробуждения запущенного воркера по user_id
+_new_gifts: dict[int, list] = {}  # Новые подарки, ещё не обработанные воркером, по user_id
+_notified_owners: set[int] = set()  # Владельцы без запущенного воркера, для которых были события
+_engine_wakeup: asyncio.Event | None = None  # Будит движок покупок, когда появляется новый владелец
+
+
+def _get_wakeup(user_id: int) -> asyncio.Event:
+    """
+    Возвращает (создаёт при необходимости) событие пробуждения воркера пользователя.
+    """
+    event = _wakeups.get(user_id)
+    if event is None:
+        event = asyncio.Event()
+        _wakeups[user_id] = event
+    return event
+
+
+def register_worker(user_id: int) -> None:
+    """
+    Отмечает, что воркер владельца запущен: события и новые подарки будут доставляться ему.
+    """
+    _get_wakeup(user_id)
+    _notified_owners.discard(user_id)
+
+
+def has_running_workers() -> bool:
+    """
+    Проверяет, запущен ли в процессе хотя бы один воркер покупок.
+    """
+    return bool(_wakeups)
+
+
+def unregister_worker(user_id: int) -> None:
+    """
+    Отмечает, что воркер владельца остановлен, и удаляет его событие и недоставленные подарки.
+    """
+    _wakeups.pop(user_id, None)
+    _new_gifts.pop(user_id, None)
+
+
+def notify_worker(user_id: int | None = None, reason: str = "") -> None:
+    """
+    Будит воркер покупок пользователя, либо все воркеры, если user_id не задан.
+    Если воркер владельца не запущен, владелец запоминается для движка покупок (take_notified_owners).
+
+    :param user_id: Telegram ID владельца воркера (None — все владельцы)
+    :param reason: Причина пробуждения (для логов)
+    """
+    if user_id is None:
+        events = list(_wakeups.values())
+    elif user_id in _wakeups:
+        events = [_wakeups[user_id]]
+    else:
+        events = []
+        _notified_owners.add(user_id)
+    for event in events:
+        event.set()
+    if user_id is not None:
+        _get_engine_wakeup().set()
+    logger.debug(f"Пробуждение воркера {user_id if user_id is not None else '*'}: {reason}")
+
+
+def clear_wakeup(user_id: int) -> None:
+    """
+    Сбрасывает событие пробуждения перед очередным проходом воркера.
+    События, пришедшие во время прохода, не теряются — они разбудят следующее ожидание.
+    """
+    _get_wakeup(user_id).clear()
+
+
+async def wait_for_wakeup(user_id: int, timeout: float | None = None) -> bool:
+    """
+    Ожидает пробуждения воркера.
+
+    :param user_id: Telegram ID владельца воркера
+    :param timeout: Максимальное время ожидания в секундах (None — без ограничения)
+    :return: True, если воркер разбужен событием, False — по таймауту
+    """
+    event = _get_wakeup(user_id)
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        return False
+    return True
+
+
+def _get_engine_wakeup() -> asyncio.Event:
+    global _engine_wakeup
+    if _engine_wakeup is None:
+        _engine_wakeup = asyncio.Event()
+    return _engine_wakeup
+
+
+def take_notified_owners() -> list[int]:
+    """
+    Забирает user_id владельцев без запущенного воркера, для которых с прошлого вызова были события
+    (например, включили покупки). Движок покупок проверяет каждого один раз.
+    """
+    owners = list(_notified_owners)
+    _notified_owners.clear()
+    return owners
+
+
+async def wait_for_engine_wakeup(timeout: float | None = None) -> bool:
+    """
+    Ожидает события любого владельца (например, включения покупок новым пользователем).
+
+    :return: True, если движок разбужен событием, False — по таймауту
+    """
+    event = _get_engine_wakeup()
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        event.clear()
+    return True
+
+
+def publish_new_gifts(gifts: list) -> None:
+    """
+    Передаёт запущенным воркерам подарки, только что появившиеся в каталоге, и будит их.
+    Воркер обрабатывает такие подарки отдельным быстрым проходом.
+    """
+    if not gifts:
+        return
+    for user_id in list(_wakeups):
+        _new_gifts.setdefault(user_id, []).extend(gifts)
+    notify_worker(reason=f"new gifts: {len(gifts)}")
+
+
+def pop_new_gifts(user_id: int) -> list:
+    """
+    Забирает накопленные для воркера новые подарки (без повторов по id).
+    """
+    gifts = _new_gifts.pop(user_id, [])
+    unique = {}
+    for gift in gifts:
+        unique[gift.id] = gift
+    return list(unique.values())
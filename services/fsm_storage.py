@@ -0,0 +1,143 @@
+# --- Стандартные библиотеки ---
+from datetime import datetime, timezone
+from typing import Any, Dict, Mapping, Optional
+import logging
+
+# --- Сторонние библиотеки ---
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from pymongo import ReturnDocument
+
+# --- Внутренние модули ---
+from services.config import FSM_STATE_TTL
+from services.db import get_fsm_collection
+
+logger = logging.getLogger(__name__)
+
+_EMPTY_PROJECTION = {"_id": 0, "updated_at": 0}
+VOLATILE_KEYS = ("code", "password")  # Код входа и облачный пароль юзербота не пишем в базу
+
+
+class MongoFSMStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в MongoDB (коллекция fsm_states из services.db).
+
+    Состояние и данные шага хранятся одним документом на пользователя/чат. Каждая запись
+    обновляет updated_at, и TTL-индекс удаляет документы, не менявшиеся FSM_STATE_TTL секунд.
+    Память процесса не растёт с числом пользователей, а после перезапуска бота
+    пользователи продолжают мастер с того же шага.
+
+    Ключи из volatile_keys (секреты авторизации юзербота) хранятся только в памяти процесса.
+    """
+
+    def __init__(self, key_builder: Optional[KeyBuilder] = None, volatile_keys=VOLATILE_KEYS):
+        """
+        :param key_builder: Построитель ключа документа (по умолчанию DefaultKeyBuilder)
+        :param volatile_keys: Ключи данных, которые не сохраняются в MongoDB
+        """
+        self._key_builder = key_builder or DefaultKeyBuilder()
+        self._volatile_keys = frozenset(volatile_keys)
+        self._volatile: dict[str, dict] = {}  # Несохраняемые данные по ключу документа
+
+    def _split(self, document_id: str, data: Mapping[str, Any], replace: bool) -> dict:
+        """
+        Отделяет несохраняемые ключи в память, возвращает данные для MongoDB.
+        """
+        volatile = {k: v for k, v in data.items() if k in self._volatile_keys}
+        if replace:
+            self._volatile.pop(document_id, None)
+        if volatile:
+            self._volatile.setdefault(document_id, {}).update(volatile)
+        return {k: v for k, v in data.items() if k not in self._volatile_keys}
+
+    async def ensure_indexes(self) -> None:
+        """
+        Создаёт TTL-индекс по updated_at (вызывается при старте бота).
+        """
+        await get_fsm_collection().create_index("updated_at", expireAfterSeconds=FSM_STATE_TTL)
+
+    @staticmethod
+    def _resolve_state(value: StateType) -> Optional[str]:
+        if value is None:
+            return None
+        if isinstance(value, State):
+            return value.state
+        return str(value)
+
+    async def _unset(self, document_id: str, field: str) -> None:
+        """
+        Удаляет поле документа, а пустой документ удаляет целиком.
+        """
+        col = get_fsm_collection()
+        updated = await col.find_one_and_update(
+            {"_id": document_id},
+            {"$unset": {field: 1}},
+            projection=_EMPTY_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+        if updated == {}:
+            await col.delete_one({"_id": document_id})
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        document_id = self._key_builder.build(key)
+        if state is None:
+            await self._unset(document_id, "state")
+            return
+        await get_fsm_collection().update_one(
+            {"_id": document_id},
+            {"$set": {"state": self._resolve_state(state), "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        document = await get_fsm_collection().find_one({"_id": self._key_builder.build(key)})
+        if document is None:
+            return None
+        return document.get("state")
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        document_id = self._key_builder.build(key)
+        data = self._split(document_id, data, replace=True)
+        if not data:
+            await self._unset(document_id, "data")
+            return
+        await get_fsm_collection().update_one(
+            {"_id": document_id},
+            {"$set": {"data": data, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        document_id = self._key_builder.build(key)
+        document = await get_fsm_collection().find_one({"_id": document_id})
+        data = dict(document.get("data") or {}) if document else {}
+        data.update(self._volatile.get(document_id, {}))
+        return data
+
+    async def update_data(self, key: StorageKey, data: Mapping[str, Any]) -> Dict[str, Any]:
+        """
+        Обновляет отдельные ключи данных одним запросом, не перечитывая документ.
+        """
+        document_id = self._key_builder.build(key)
+        data = self._split(document_id, data, replace=False)
+        if not data:
+            return await self.get_data(key)
+        update = {f"data.{name}": value for name, value in data.items()}
+        update["updated_at"] = datetime.now(timezone.utc)
+        document = await get_fsm_collection().find_one_and_update(
+            {"_id": document_id},
+            {"$set": update},
+            upsert=True,
+            projection=_EMPTY_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+        result = dict((document or {}).get("data", {}))
+        result.update(self._volatile.get(document_id, {}))
+        return result
+
+    async def close(self) -> None:
+        # Клиент MongoDB общий (services.db) и закрывается вместе с процессом
+        pass
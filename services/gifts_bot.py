@@ -1,73 +1,99 @@
+# --- Стандартные библиотеки ---
+import asyncio
+import time
+
 # --- Внутренние модули ---
 from utils.mockdata import generate_test_gifts
-from services.config import DEV_MODE
+from services.config import DEV_MODE, BOT_CATALOG_WAIT, BOT_CATALOG_MAX_INTERVAL
+from services.catalog import CatalogSnapshot, GiftRecord, gift_record, gift_from_dict
+
+bot_catalog: CatalogSnapshot = CatalogSnapshot(source="bot")  # Последний снимок каталога бота
+last_update_bot: float = 0
+_bot_catalog_ready = asyncio.Event()  # Установлено, пока снимок свежий (сбрасывается при запросе устаревшего)
+_catalog_demand = asyncio.Event()  # Устанавливается, когда запрошен устаревший снимок: будит опросчик в простое
+_CATALOG_STALE_AFTER = BOT_CATALOG_MAX_INTERVAL * 2  # Снимок старше этого (секунд) считается устаревшим
+_dev_catalog: tuple[CatalogSnapshot, CatalogSnapshot] | None = None  # (снимок бота, он же с тестовыми подарками)
 
-def normalize_gift(gift) -> dict:
+def normalize_gift(gift) -> GiftRecord:
     """
-    Преобразует объект Gift в словарь с основными характеристиками подарка.
+    Преобразует объект Gift в общую запись о подарке.
 
     :param gift: Объект Gift.
-    :return: Словарь с параметрами подарка.
+    :return: Запись о подарке (переиспользуется, если подарок не изменился).
     """
-    return {
-        "id": getattr(gift, "id", None),
-        "price": getattr(gift, "star_count", 0),
-        "supply": getattr(gift, "total_count", 0),
-        "left": getattr(gift, "remaining_count", 0),
-        "sticker_file_id": getattr(getattr(gift, "sticker", None), "file_id", None),
-        "emoji": getattr(getattr(gift, "sticker", None), "emoji", None),
-    }
+    sticker = gift.sticker
+    return gift_record(
+        gift.id,
+        gift.star_count,
+        gift.total_count,
+        gift.remaining_count,
+        sticker.file_id if sticker else None,
+        sticker.emoji if sticker else None
+    )
 
 
-async def get_filtered_gifts(
-    bot, 
-    min_price, 
-    max_price, 
-    min_supply, 
-    max_supply, 
-    unlimited=False,
-    add_test_gifts=False,
-    test_gifts_count=5
-):
+async def fetch_bot_catalog(bot) -> CatalogSnapshot:
     """
-    Получает и фильтрует список подарков из API, возвращает их в нормализованном виде.
-    
+    Запрашивает каталог у Bot API и делает его текущим снимком.
+    Единственное место, где вызывается bot.get_available_gifts — его вызывает
+    фоновый опросчик gifts_manager.bot_gifts_updater.
+
     :param bot: Экземпляр бота aiogram.
-    :param min_price: Минимальная цена подарка.
-    :param max_price: Максимальная цена подарка.
-    :param min_supply: Минимальный supply подарка.
-    :param max_supply: Максимальный supply подарка.
-    :param unlimited: Если True — игнорировать supply при фильтрации.
-    :param add_test_gifts: Добавлять тестовые подарки в конец списка.
-    :param test_gifts_count: Количество тестовых подарков.
-    :return: Список словарей с параметрами подарков, отсортированный по цене по убыванию.
+    :return: Новый снимок каталога, отсортированный по цене.
     """
-    # Получаем, нормализуем и фильтруем подарки из маркета
+    global bot_catalog, last_update_bot
     api_gifts = await bot.get_available_gifts()
-    filtered = []
-    for gift in api_gifts.gifts:
-        price_ok = min_price <= gift.star_count <= max_price
-        # Логика по unlimited
-        if unlimited:
-            supply_ok = True
-        else:
-            supply = gift.total_count or 0
-            supply_ok = min_supply <= supply <= max_supply
-        if price_ok and supply_ok:
-            filtered.append(gift)
-    normalized = [normalize_gift(gift) for gift in filtered]
+    bot_catalog = CatalogSnapshot([normalize_gift(gift) for gift in api_gifts.gifts], source="bot")
+    last_update_bot = time.monotonic()
+    _bot_catalog_ready.set()
+    return bot_catalog
+
+
+async def get_bot_catalog(wait: float = BOT_CATALOG_WAIT) -> CatalogSnapshot:
+    """
+    Возвращает последний снимок каталога бота без запроса к Telegram.
+    Если снимок устарел (опросчик простаивает или процесс только запущен), будит опросчик
+    и ждёт свежий снимок не дольше wait секунд.
+
+    :param wait: Максимальное ожидание свежего снимка в секундах.
+    :return: Снимок каталога, отсортированный по цене (пустой, если каталог ещё не получен).
+    """
+    if time.monotonic() - last_update_bot > _CATALOG_STALE_AFTER:
+        _bot_catalog_ready.clear()
+        _catalog_demand.set()
+    if not _bot_catalog_ready.is_set():
+        try:
+            await asyncio.wait_for(_bot_catalog_ready.wait(), wait)
+        except asyncio.TimeoutError:
+            pass
+    return bot_catalog
 
-    # Получаем и фильтруем тестовые подарки отдельно
-    test_gifts = []
-    if add_test_gifts or DEV_MODE:
-        test_gifts = generate_test_gifts(test_gifts_count)
-        test_gifts = [
-            gift for gift in test_gifts
-            if min_price <= gift["price"] <= max_price and (
-                unlimited or min_supply <= gift["supply"] <= max_supply
-            )
-        ]
 
-    all_gifts = normalized + test_gifts
-    all_gifts .sort(key=lambda g: g["price"], reverse=True)
-    return all_gifts 
+async def wait_catalog_demand(timeout: float) -> bool:
+    """
+    Ожидает запроса устаревшего снимка каталога (для опросчика в простое).
+
+    :return: True, если снимок запросили, False — по таймауту
+    """
+    try:
+        await asyncio.wait_for(_catalog_demand.wait(), timeout)
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        _catalog_demand.clear()
+    return True
+
+
+async def get_catalog_snapshot(test_gifts_count=5) -> CatalogSnapshot:
+    """
+    Возвращает снимок каталога для показа пользователю: снимок бота,
+    а в режиме разработки — он же с тестовыми подарками (один производный снимок на снимок бота).
+    """
+    global _dev_catalog
+    catalog = await get_bot_catalog()
+    if not DEV_MODE:
+        return catalog
+    if _dev_catalog is None or _dev_catalog[0] is not catalog:
+        gifts = list(catalog) + [gift_from_dict(g) for g in generate_test_gifts(test_gifts_count)]
+        _dev_catalog = (catalog, CatalogSnapshot(gifts, source="bot-dev", created_at=catalog.created_at))
+    return _dev_catalog[1]
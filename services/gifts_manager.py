@@ -1,97 +1,199 @@
 # --- Стандартные библиотеки ---
 import time
-import random
-import asyncio
 import logging
 
+# --- Сторонние библиотеки ---
+from aiogram.exceptions import TelegramRetryAfter
+from pyrogram.errors import FloodWait
+
 # --- Внутренние модули ---
-from services.config import USERBOT_UPDATE_COOLDOWN
-from services.gifts_bot import get_filtered_gifts
-from services.gifts_userbot import get_userbot_filtered_gifts
+from services.config import (
+    USERBOT_UPDATE_COOLDOWN,
+    USERBOT_UPDATE_MIN_INTERVAL,
+    BOT_CATALOG_MIN_INTERVAL,
+    BOT_CATALOG_MAX_INTERVAL,
+    BOT_CATALOG_IDLE_INTERVAL,
+    CATALOG_BOOST_DURATION
+)
+from services.events import notify_worker, publish_new_gifts, has_running_workers
+from services.polling import AdaptivePoller
+from services.catalog import CatalogSnapshot, CatalogDiff, GiftRecord, diff_catalogs, merge_catalogs
+from services.gifts_bot import fetch_bot_catalog, get_catalog_snapshot, wait_catalog_demand
+from services.gifts_userbot import get_userbot_catalog
 
 logger = logging.getLogger(__name__)
 
-userbot_all_gifts: list[dict] = []
+userbot_all_gifts: CatalogSnapshot = CatalogSnapshot(source="userbot")
 last_update_userbot: float = 0
+_observed_catalogs: dict[str, CatalogSnapshot] = {}  # Последний обработанный снимок по источнику
+catalog_pollers: dict[str, AdaptivePoller] = {}  # Планировщики опроса каталога по имени источника
+_merged_catalog: tuple[tuple, CatalogSnapshot] | None = None  # (исходные снимки, объединённый снимок)
+
+
+def observe_catalog(snapshot: CatalogSnapshot) -> CatalogDiff | None:
+    """
+    Сравнивает снимок с предыдущим снимком того же источника и рассылает события:
+    новые подарки уходят воркерам на быстрый путь и переводят все опросчики в частый режим,
+    остальные изменения просто будят воркеры.
+
+    :param snapshot: Свежий снимок каталога
+    :return: Разница со старым снимком или None, если снимок первый (или уже обработан)
+    """
+    previous = _observed_catalogs.get(snapshot.source)
+    if previous is snapshot:
+        return None
+    _observed_catalogs[snapshot.source] = snapshot
+    if previous is None:
+        return None
+
+    diff = diff_catalogs(previous, snapshot)
+    if diff.added:
+        logger.info(f"Новые подарки в каталоге ({snapshot.source}): {[g.id for g in diff.added]}")
+        # Начался дроп: остальные источники тоже переходят на частый опрос
+        expect_gift_drop()
+        publish_new_gifts(list(diff.added))
+    elif diff:
+        notify_worker(reason=f"catalog {snapshot.source}")
+    return diff
+
+
+def get_polling_intervals() -> dict[str, float]:
+    """
+    Возвращает текущие интервалы опроса каталога по источникам (в секундах).
+    """
+    return {name: poller.interval for name, poller in catalog_pollers.items()}
+
+
+def expect_gift_drop(duration: float = CATALOG_BOOST_DURATION) -> None:
+    """
+    Переводит все опросчики каталога в частый режим на duration секунд (ожидается дроп).
+    """
+    for poller in catalog_pollers.values():
+        poller.expect_drop(duration)
+
+
+async def bot_gifts_updater(bot):
+    """
+    Фоновая задача: опрашивает каталог бота с адаптивным интервалом и рассылает события
+    об изменениях (новые подарки, изменение остатков). Это единственный источник запросов
+    каталога к Bot API: каталог в интерфейсе и воркеры читают её последний снимок.
+    Пока в процессе нет запущенных воркеров покупок, каталог запрашивается только
+    по требованию (кто-то прочитал устаревший снимок) или раз в BOT_CATALOG_IDLE_INTERVAL секунд.
+
+    :param bot: Объект aiogram-бота
+    """
+    poller = catalog_pollers.setdefault("bot", AdaptivePoller(
+        "bot",
+        min_interval=BOT_CATALOG_MIN_INTERVAL,
+        max_interval=BOT_CATALOG_MAX_INTERVAL,
+        boost_duration=CATALOG_BOOST_DURATION
+    ))
+    while True:
+        try:
+            diff = observe_catalog(await fetch_bot_catalog(bot))
+            poller.on_result(bool(diff))
+        except TelegramRetryAfter as e:
+            poller.on_flood_wait(e.retry_after)
+        except Exception as e:
+            logger.error(f"Ошибка в bot_gifts_updater: {e}")
+        await poller.sleep()
+        if not has_running_workers():
+            await wait_catalog_demand(BOT_CATALOG_IDLE_INTERVAL)
+
 
 async def userbot_gifts_updater(user_id: int, base_interval: int = USERBOT_UPDATE_COOLDOWN):
     """
     Запускает фоновую задачу для регулярного обновления кеша подарков от юзербота.
+    Интервал адаптивный: от USERBOT_UPDATE_MIN_INTERVAL после изменений
+    до base_interval + 10 секунд при стабильном каталоге.
 
     :param user_id: Telegram ID владельца userbot-сессии
-    :param base_interval: Минимальный интервал обновления (в секундах); 
-                          фактическая пауза будет от base_interval до base_interval + 10
+    :param base_interval: Базовый интервал обновления при стабильном каталоге (в секундах)
     """
     global userbot_all_gifts, last_update_userbot
+    poller = catalog_pollers.setdefault(f"userbot:{user_id}", AdaptivePoller(
+        f"userbot:{user_id}",
+        min_interval=USERBOT_UPDATE_MIN_INTERVAL,
+        max_interval=base_interval + 10,
+        boost_duration=CATALOG_BOOST_DURATION
+    ))
     while True:
         try:
-            userbot_all_gifts = await get_userbot_filtered_gifts(
-                user_id,
-                min_price=1,
-                max_price=10000000,
-                min_supply=1,
-                max_supply=100000000,
-                unlimited=False
-            )
-            last_update_userbot = time.time()
+            gifts = await get_userbot_catalog(user_id)
+            if gifts is None:
+                # Каталог не изменился (StarGiftsNotModified): кеш подтверждён свежим
+                last_update_userbot = time.time()
+                poller.on_result(False)
+            # Пустой ответ — сессия неактивна или ошибка: не считаем это изменением каталога
+            elif gifts:
+                userbot_all_gifts = CatalogSnapshot(gifts, source="userbot")
+                last_update_userbot = userbot_all_gifts.created_at
+                diff = observe_catalog(userbot_all_gifts)
+                poller.on_result(bool(diff))
+            else:
+                poller.on_result(False)
+        except FloodWait as e:
+            poller.on_flood_wait(e.value)
         except Exception as e:
             logger.error(f"Ошибка в userbot_gifts_updater: {e}")
-        delay = random.randint(base_interval, base_interval + 10)
-        await asyncio.sleep(delay)
+        await poller.sleep()
 
 
-def is_userbot_cache_fresh(max_age: int = USERBOT_UPDATE_COOLDOWN + 10) -> bool:
+def is_userbot_cache_fresh(max_age: float | None = None) -> bool:
     """
     Проверяет, актуален ли кеш userbot.
 
-    :param max_age: Максимальное допустимое время с последнего обновления (в секундах)
+    :param max_age: Максимальное допустимое время с последнего обновления (в секундах).
+                    По умолчанию — наибольшая пауза опросчика userbot плюс время на сам запрос,
+                    чтобы кеш не считался устаревшим между штатными опросами.
     :return: True, если кеш свежий
     """
+    if max_age is None:
+        pollers = [p for name, p in catalog_pollers.items() if name.startswith("userbot:")]
+        max_delay = max((p.max_delay for p in pollers), default=USERBOT_UPDATE_COOLDOWN + 10)
+        max_age = max_delay + USERBOT_UPDATE_MIN_INTERVAL
     return time.time() - last_update_userbot < max_age
 
 
-def filter_gifts_by_profile(gifts: list[dict], profile: dict) -> list[dict]:
+def filter_gifts_by_profile(gifts: CatalogSnapshot, profile: dict) -> list[GiftRecord]:
     """
-    Фильтрует список подарков по параметрам конкретного профиля.
+    Фильтрует снимок каталога по параметрам конкретного профиля.
 
-    :param gifts: Список всех доступных подарков (словари)
+    :param gifts: Снимок всех доступных подарков
     :param profile: Словарь с параметрами профиля (ценовой диапазон, лимиты)
-    :return: Отфильтрованный список подарков, подходящих под профиль
+    :return: Отфильтрованный список подарков (по убыванию цены), подходящих под профиль
     """
-    return [
-        g for g in gifts
-        if profile["MIN_PRICE"] <= g.get("price", 0) <= profile["MAX_PRICE"]
-        and profile["MIN_SUPPLY"] <= g.get("supply", 0) <= profile["MAX_SUPPLY"]
-    ]
+    return gifts.select_for_profile(profile)
 
 
-async def get_best_gift_list(bot, profile: dict) -> list[dict]:
+def get_merged_catalog(bot_catalog: CatalogSnapshot) -> CatalogSnapshot:
     """
-    Возвращает наиболее полный список подарков — либо от бота, либо от userbot,
-    в зависимости от того, где подарков больше, при условии фильтрации под профиль.
+    Возвращает каталог, объединённый по id подарка из снимка бота и кеша userbot
+    (если кеш userbot свежий). Для каждого подарка берётся самое свежее наблюдение.
+    Объединённый снимок пересобирается только при смене одного из исходных снимков.
+
+    :param bot_catalog: Текущий снимок каталога бота
+    :return: Объединённый снимок каталога
+    """
+    global _merged_catalog
+    sources = (bot_catalog, userbot_all_gifts) if is_userbot_cache_fresh() else (bot_catalog,)
+    if _merged_catalog is not None:
+        cached_sources, merged = _merged_catalog
+        if len(cached_sources) == len(sources) and all(a is b for a, b in zip(cached_sources, sources)):
+            return merged
+    merged = merge_catalogs(*sources)
+    _merged_catalog = (sources, merged)
+    return merged
+
+
+async def get_best_gift_list(profile: dict) -> list[GiftRecord]:
+    """
+    Возвращает подарки под профиль из объединённого каталога бота и userbot:
+    подарок, замеченный любым из источников, не теряется, а его данные берутся
+    из самого свежего наблюдения.
 
-    :param bot: Объект aiogram-бота
-    :param user_id: Telegram ID владельца userbot-сессии
     :param profile: Словарь с параметрами профиля (фильтрация по цене, количеству и т.д.)
-    :return: Отфильтрованный список подарков (в виде list[dict])
-    """
-    global userbot_all_gifts
-
-    try:
-        gifts_bot = await get_filtered_gifts(
-            bot,
-            profile["MIN_PRICE"],
-            profile["MAX_PRICE"],
-            profile["MIN_SUPPLY"],
-            profile["MAX_SUPPLY"]
-        )
-    except Exception as e:
-        logger.error(f"Ошибка получения списка подарков от бота: {e}")
-        gifts_bot = []
-
-    gifts_userbot = filter_gifts_by_profile(userbot_all_gifts, profile)
-
-    if is_userbot_cache_fresh() and len(gifts_userbot) > len(gifts_bot):
-        return gifts_userbot
-    
-    return gifts_bot
+    :return: Отфильтрованный список подарков (записи GiftRecord), по убыванию цены
+    """
+    catalog_bot = await get_catalog_snapshot()
+    return filter_gifts_by_profile(get_merged_catalog(catalog_bot), profile)
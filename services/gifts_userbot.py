@@ -2,85 +2,104 @@
 import logging
 
 # --- Сторонние библиотеки ---
+from pyrogram import raw
 from pyrogram.types import Gift
+from pyrogram.errors import FloodWait
 
 # --- Внутренние модули ---
 from utils.mockdata import generate_test_gifts
 from services.config import DEV_MODE, get_valid_config
+from services.catalog import GiftRecord, gift_record, gift_from_dict
 from services.userbot import get_userbot_client, is_userbot_active
 
 logger = logging.getLogger(__name__)
 
-def normalize_gift(gift: Gift) -> dict:
+_star_gifts: dict[int, tuple[int, list[Gift]]] = {}  # Последний ответ GetStarGifts по user_id: (хеш, подарки)
+_published_hashes: dict[int, int] = {}  # Хеш каталога, последним отданного get_userbot_catalog, по user_id
+
+def normalize_gift(gift: Gift) -> GiftRecord:
     """
-    Преобразует объект Gift из Pyrogram в словарь с ключевыми характеристиками подарка.
+    Преобразует объект Gift из Pyrogram в общую запись о подарке.
+    ID приводится к строке, а тираж и остаток не лимитированного подарка — к None, как в Bot API,
+    чтобы один подарок из обоих источников имел один ключ и одну запись.
+    Распроданный подарок получает остаток 0: это наблюдение должно перекрыть
+    более старые данные других источников при объединении каталогов.
     """
-    return {
-        "id": gift.id,
-        "price": gift.price or 0,
-        "supply": gift.total_amount or 0,
-        "left": gift.available_amount or 0,
-        "sticker_file_id": getattr(gift.sticker, "file_id", None),
-        "emoji": getattr(gift.sticker, "emoji", None)
-    }
+    sticker = gift.sticker
+    limited = bool(gift.total_amount)
+    left = 0 if gift.is_sold_out else (gift.available_amount or 0)
+    return gift_record(
+        str(gift.id),
+        gift.price or 0,
+        gift.total_amount if limited else None,
+        left if limited else None,
+        sticker.file_id if sticker else None,
+        sticker.emoji if sticker else None
+    )
 
 
-async def get_userbot_filtered_gifts(
-    user_id: int = None,
-    min_price: int = 1,
-    max_price: int = 1000000,
-    min_supply: int = 1,
-    max_supply: int = 100000000,
-    unlimited: bool = False,
-    add_test_gifts: bool = False,
-    test_gifts_count: int = 5
-) -> list[dict]:
+async def _get_catalog_client(user_id: int):
     """
-    Получает список подарков через Pyrogram userbot и фильтрует их по заданным параметрам.
-    Возвращает пустой список, если сессия не активна или отключена в конфиге.
+    Возвращает запущенный клиент userbot, если сессия активна и включена в конфиге, иначе None.
     """
     if not is_userbot_active(user_id):
-        return []
+        return None
+    config = await get_valid_config(user_id)
+    userbot_config = config.get("USERBOT", {})
+    if not (userbot_config.get("API_ID") and userbot_config.get("API_HASH") and userbot_config.get("PHONE")):
+        return None
+    if not userbot_config.get("ENABLED", False):
+        return None
+    return await get_userbot_client(user_id)
+
+
+async def fetch_available_gifts(userbot, user_id: int) -> tuple[list[Gift], int]:
+    """
+    Запрашивает каталог через payments.GetStarGifts с хешем предыдущего ответа.
+    Если каталог не менялся, Telegram отвечает коротким StarGiftsNotModified
+    и возвращается уже разобранный список, без повторной загрузки и разбора подарков.
+
+    :param userbot: Запущенный Pyrogram Client
+    :param user_id: Telegram ID владельца сессии (ключ кеша хеша)
+    :return: (список Gift, хеш каталога)
+    """
+    cached = _star_gifts.get(user_id)
+    result = await userbot.invoke(
+        raw.functions.payments.GetStarGifts(hash=cached[0] if cached else 0)
+    )
+    if isinstance(result, raw.types.payments.StarGiftsNotModified):
+        return cached[1], cached[0]
+    gifts = [await Gift._parse_regular(userbot, gift) for gift in result.gifts]
+    _star_gifts[user_id] = (result.hash, gifts)
+    return gifts, result.hash
+
 
+async def get_userbot_catalog(user_id: int) -> list[GiftRecord] | None:
+    """
+    Возвращает весь доступный (не распроданный) каталог userbot для фонового опросчика.
+
+    :param user_id: Telegram ID владельца userbot-сессии
+    :return: None, если каталог не изменился с прошлого вызова;
+             пустой список, если сессия не активна или произошла ошибка
+    """
     try:
-        config = await get_valid_config(user_id)
-        userbot_config = config.get("USERBOT", {})
-        if not (userbot_config.get("API_ID") and userbot_config.get("API_HASH") and userbot_config.get("PHONE")):
-            return []
-        if not userbot_config.get("ENABLED", False):
+        userbot = await _get_catalog_client(user_id)
+        if userbot is None:
             return []
-        
-        userbot = await get_userbot_client(user_id)
-        gifts: list[Gift] = await userbot.get_available_gifts()
+        gifts, catalog_hash = await fetch_available_gifts(userbot, user_id)
+    except FloodWait:
+        # Пробрасываем, чтобы опросчик каталога мог увеличить паузу
+        raise
     except Exception as e:
         logger.error(f"Ошибка получения подарков от userbot: {e}")
         return []
-    
-    filtered = []
-    for gift in gifts:
-        price = gift.price or 0
-        supply = gift.total_amount or 0
-
-        if gift.is_sold_out: continue
-
-        price_ok = min_price <= price <= max_price
-        supply_ok = min_supply <= supply <= max_supply
-
-        if unlimited and gift.is_limited == False:
-            supply_ok = True
-
-        if price_ok and supply_ok:
-            filtered.append(normalize_gift(gift))
+    if _published_hashes.get(user_id) == catalog_hash:
+        return None
+    _published_hashes[user_id] = catalog_hash
 
-    if add_test_gifts or DEV_MODE:
-        test_gifts = generate_test_gifts(test_gifts_count)
-        test_filtered = [
-            g for g in test_gifts
-            if min_price <= g["price"] <= max_price and (
-                unlimited or min_supply <= g["supply"] <= max_supply
-            )
-        ]
-        filtered += test_filtered
+    # Распроданные подарки остаются в снимке (с остатком 0), в выборки они не попадают
+    catalog = [normalize_gift(gift) for gift in gifts]
+    if DEV_MODE:
+        catalog += [gift_from_dict(g) for g in generate_test_gifts(5)]
+    return catalog
 
-    filtered.sort(key=lambda g: g["price"], reverse=True)
-    return filtered
\ No newline at end of file
@@ -0,0 +1,107 @@
+# --- Стандартные библиотеки ---
+import logging
+import os
+import socket
+import time
+import uuid
+
+# --- Сторонние библиотеки ---
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# --- Внутренние модули ---
+from services.config import LEASE_TTL, LEASE_SAFETY_MARGIN
+from services.db import get_worker_leases_collection
+
+logger = logging.getLogger(__name__)
+
+# Уникальный идентификатор процесса-воркера
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_held: dict[int, float] = {}  # Захваченные владельцы → time.monotonic() окончания аренды (оценка снизу)
+
+# Время аренды считает MongoDB ($$NOW), а не часы процессов, которые на разных хостах расходятся
+_LEASE_EXPIRES = {"$add": ["$$NOW", LEASE_TTL * 1000]}
+_LEASE_EXPIRED = {"$expr": {"$lt": ["$expires_at", "$$NOW"]}}
+
+
+async def ensure_lease_indexes() -> None:
+    """
+    Создаёт индексы коллекции аренды владельцев (вызывается при старте).
+    """
+    col = get_worker_leases_collection()
+    await col.create_index([("holder", ASCENDING)])
+    await col.create_index([("expires_at", ASCENDING)])
+
+
+async def claim_owner(owner_id: int) -> bool:
+    """
+    Пытается захватить владельца: аренда свободна, истекла или уже принадлежит этому процессу.
+
+    :return: True, если владелец закреплён за процессом на LEASE_TTL секунд
+    """
+    # Запрос отправлен не раньше, чем сервер отсчитал срок, поэтому локальный срок не позже серверного
+    started = time.monotonic()
+    col = get_worker_leases_collection()
+    try:
+        doc = await col.find_one_and_update(
+            {"_id": owner_id, "$or": [{"holder": WORKER_ID}, _LEASE_EXPIRED]},
+            [{"$set": {"holder": WORKER_ID, "expires_at": _LEASE_EXPIRES, "renewed_at": "$$NOW"}}],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Документ есть, и аренда действующая у другого процесса
+        return False
+    if not doc or doc.get("holder") != WORKER_ID:
+        return False
+    _held[owner_id] = started + LEASE_TTL
+    return True
+
+
+async def renew_leases() -> list[int]:
+    """
+    Продлевает аренду всех захваченных владельцев (heartbeat).
+
+    :return: Владельцы, аренду которых продлить не удалось (их захватил другой процесс)
+    """
+    lost = []
+    col = get_worker_leases_collection()
+    for owner_id in list(_held):
+        started = time.monotonic()
+        try:
+            doc = await col.find_one_and_update(
+                {"_id": owner_id, "holder": WORKER_ID},
+                [{"$set": {"expires_at": _LEASE_EXPIRES, "renewed_at": "$$NOW"}}],
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception as e:
+            # Нет связи с MongoDB: аренда истечёт сама, holds_lease перестанет её подтверждать
+            logger.error(f"Не удалось продлить аренду владельца {owner_id}: {e}")
+            continue
+        if doc is None:
+            _held.pop(owner_id, None)
+            lost.append(owner_id)
+            logger.warning(f"Аренда владельца {owner_id} потеряна процессом {WORKER_ID}")
+        else:
+            _held[owner_id] = started + LEASE_TTL
+    return lost
+
+
+async def release_owner(owner_id: int) -> None:
+    """
+    Освобождает аренду владельца, чтобы его сразу мог забрать другой процесс.
+    """
+    _held.pop(owner_id, None)
+    col = get_worker_leases_collection()
+    await col.delete_one({"_id": owner_id, "holder": WORKER_ID})
+
+
+def holds_lease(owner_id: int) -> bool:
+    """
+    Проверяет по локальным данным, что аренда владельца действующая.
+    Если продление не проходит, аренда перестаёт подтверждаться за LEASE_SAFETY_MARGIN секунд
+    до того, как её сможет забрать другой процесс: покупка, начатая до этого момента, успевает завершиться.
+    """
+    expires_at = _held.get(owner_id)
+    return expires_at is not None and time.monotonic() < expires_at - LEASE_SAFETY_MARGIN
@@ -4,15 +4,13 @@ from aiogram.exceptions import TelegramBadRequest
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 # --- Внутренние библиотеки ---
-from services.config import load_config, save_config, get_valid_config, format_config_summary
+from services.config import load_config, update_config, get_valid_config, format_config_summary
 
 async def update_last_menu_message_id(message_id: int, user_id: int):
     """
     Сохраняет id последнего сообщения с меню в конфиг.
     """
-    config = await load_config(user_id=user_id)
-    config["LAST_MENU_MESSAGE_ID"] = message_id
-    await save_config(config, user_id=user_id)
+    await update_config(user_id, set_fields={"LAST_MENU_MESSAGE_ID": message_id})
 
 
 async def get_last_menu_message_id(user_id: int):
@@ -0,0 +1,130 @@
+# --- Стандартные библиотеки ---
+import logging
+
+# --- Сторонние библиотеки ---
+from pymongo import ASCENDING, ReturnDocument
+
+# --- Внутренние модули ---
+from services.config import ORDER_RECLAIM_TIMEOUT
+from services.db import get_purchase_orders_collection
+from services.events import notify_worker
+
+logger = logging.getLogger(__name__)
+
+# Заказ ждёт выполнения или брошен процессом, который начал его больше ORDER_RECLAIM_TIMEOUT секунд назад
+# (процесс упал или потерял владельца). Время считает MongoDB ($$NOW), как и для аренды владельцев.
+_CLAIMABLE = {"$or": [
+    {"status": "pending"},
+    {"status": "running", "$expr": {"$lt": ["$started_at", {"$subtract": ["$$NOW", ORDER_RECLAIM_TIMEOUT * 1000]}]}},
+]}
+
+
+async def ensure_order_indexes() -> None:
+    """
+    Создаёт индексы коллекции заказов на покупку (вызывается при старте).
+    """
+    col = get_purchase_orders_collection()
+    await col.create_index([("owner_id", ASCENDING), ("status", ASCENDING)])
+    await col.create_index([("status", ASCENDING)])
+
+
+async def submit_order(
+    owner_id: int,
+    chat_id: int,
+    gift_id,
+    gift_price: int,
+    quantity: int,
+    target_user_id: int | None,
+    target_chat_id: str | None,
+    gift_display: str
+) -> None:
+    """
+    Ставит покупку юзерботом в очередь процесса, который обслуживает владельца.
+    Нужна, когда юзербот владельца запущен в другом процессе-воркере (WORKER_SHARDING=1):
+    результат придёт пользователю отдельным сообщением.
+
+    :param owner_id: Telegram ID владельца (его юзербот выполняет покупку)
+    :param chat_id: Чат, куда отправить результат
+    :param gift_id: ID подарка
+    :param gift_price: Цена одного подарка
+    :param quantity: Количество подарков
+    :param target_user_id: ID получателя-пользователя (или None)
+    :param target_chat_id: ID получателя-чата (или None)
+    :param gift_display: Описание подарка для сообщения с результатом
+    """
+    col = get_purchase_orders_collection()
+    await col.insert_one({
+        "owner_id": owner_id,
+        "chat_id": chat_id,
+        "gift_id": gift_id,
+        "gift_price": gift_price,
+        "quantity": quantity,
+        "target_user_id": target_user_id,
+        "target_chat_id": target_chat_id,
+        "gift_display": gift_display,
+        "status": "pending",
+    })
+    notify_worker(owner_id, reason="purchase order")
+
+
+async def get_owners_with_orders() -> list[int]:
+    """
+    Возвращает владельцев, у которых есть невыполненные (или брошенные) заказы.
+    """
+    col = get_purchase_orders_collection()
+    return await col.distinct("owner_id", _CLAIMABLE)
+
+
+async def has_pending_orders(owner_id: int) -> bool:
+    """
+    Проверяет, есть ли у владельца невыполненные (или брошенные) заказы.
+    """
+    col = get_purchase_orders_collection()
+    return await col.find_one({"owner_id": owner_id, **_CLAIMABLE}, {"_id": 1}) is not None
+
+
+async def take_order(owner_id: int, worker_id: str) -> dict | None:
+    """
+    Забирает самый старый невыполненный заказ владельца (атомарно, один заказ — один процесс).
+    Брошенный другим процессом заказ забирается заново (см. ORDER_RECLAIM_TIMEOUT).
+    """
+    col = get_purchase_orders_collection()
+    order = await col.find_one_and_update(
+        {"owner_id": owner_id, **_CLAIMABLE},
+        [{"$set": {"status": "running", "worker": worker_id, "started_at": "$$NOW"}}],
+        sort=[("_id", ASCENDING)],
+        return_document=ReturnDocument.BEFORE
+    )
+    if order is None:
+        return None
+    if order["status"] == "running":
+        logger.warning(f"[{owner_id}] Заказ {order['_id']} брошен процессом {order.get('worker')}, выполняется заново")
+    order.update(status="running", worker=worker_id)
+    return order
+
+
+async def finish_order(order_id, bought: int) -> None:
+    """
+    Отмечает заказ выполненным.
+    """
+    col = get_purchase_orders_collection()
+    await col.update_one(
+        {"_id": order_id},
+        [{"$set": {"status": "done", "bought": bought, "finished_at": "$$NOW"}}]
+    )
+
+
+def purchase_result_text(gift_display: str, bought: int, quantity: int, target_display: str) -> str:
+    """
+    Текст сообщения с итогом покупки подарков из каталога.
+    """
+    if bought == quantity:
+        return (f"✅ Покупка <b>{gift_display}</b> успешно завершена!\n"
+                f"🎁 Куплено подарков: <b>{bought}</b> из <b>{quantity}</b>\n"
+                f"👤 Получатель: {target_display}")
+    return (f"⚠️ Покупка <b>{gift_display}</b> остановлена.\n"
+            f"🎁 Куплено подарков: <b>{bought}</b> из <b>{quantity}</b>\n"
+            f"👤 Получатель: {target_display}\n"
+            f"💰 Пополните баланс! Проверьте адрес получателя!\n"
+            f"📦 Проверьте доступность подарка!\n"
+            f"🚦 Статус изменён на 🔴 (неактивен).")
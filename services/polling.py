@@ -0,0 +1,97 @@
+# --- Стандартные библиотеки ---
+import asyncio
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptivePoller:
+    """
+    Адаптивный интервал опроса источника (каталога подарков).
+
+    - Пока данные не меняются, интервал плавно растёт до max_interval.
+    - После замеченного изменения или при ожидании дропа интервал сжимается до min_interval
+      на время boost_duration.
+    - При FloodWait опрос приостанавливается на указанное Telegram время,
+      а базовый интервал удваивается (не выше max_interval).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        min_interval: float,
+        max_interval: float,
+        boost_duration: float = 60,
+        growth: float = 1.5,
+        jitter: float = 0.2
+    ):
+        """
+        :param name: Имя источника (для логов)
+        :param min_interval: Минимальный интервал опроса в секундах
+        :param max_interval: Максимальный интервал опроса в секундах
+        :param boost_duration: Сколько секунд держать минимальный интервал после изменения
+        :param growth: Множитель роста интервала при стабильном каталоге
+        :param jitter: Доля случайного разброса интервала
+        """
+        self.name = name
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.boost_duration = boost_duration
+        self.growth = growth
+        self.jitter = jitter
+        self._interval = max_interval
+        self._boost_until = 0.0
+        self._flood_until = 0.0
+
+    @property
+    def interval(self) -> float:
+        """
+        Текущий интервал опроса в секундах (без учёта разброса).
+        """
+        now = time.monotonic()
+        if now < self._flood_until:
+            return self._flood_until - now
+        if now < self._boost_until:
+            return self.min_interval
+        return self._interval
+
+    @property
+    def max_delay(self) -> float:
+        """
+        Наибольшая пауза между опросами без FloodWait (максимальный интервал с учётом разброса).
+        """
+        return self.max_interval * (1 + self.jitter)
+
+    def on_result(self, changed: bool) -> None:
+        """
+        Учитывает результат опроса: изменение сжимает интервал, стабильность — растягивает.
+        """
+        if changed:
+            self._interval = self.min_interval
+            self._boost_until = time.monotonic() + self.boost_duration
+        else:
+            self._interval = min(self.max_interval, self._interval * self.growth)
+
+    def on_flood_wait(self, seconds: float) -> None:
+        """
+        Учитывает FloodWait: пауза на seconds и удвоение базового интервала.
+        """
+        self._flood_until = time.monotonic() + seconds
+        self._boost_until = 0.0
+        self._interval = min(self.max_interval, self._interval * 2)
+        logger.warning(f"[{self.name}] FloodWait {seconds} сек., интервал опроса {self._interval:.1f} сек.")
+
+    def expect_drop(self, duration: float | None = None) -> None:
+        """
+        Переводит опрос в частый режим на duration секунд (по умолчанию boost_duration).
+        """
+        self._boost_until = time.monotonic() + (duration if duration is not None else self.boost_duration)
+
+    async def sleep(self) -> None:
+        """
+        Ждёт до следующего опроса с небольшим случайным разбросом.
+        """
+        delay = self.interval * random.uniform(1, 1 + self.jitter)
+        await asyncio.sleep(delay)
@@ -0,0 +1,90 @@
+# --- Стандартные библиотеки ---
+import asyncio
+import logging
+import time
+
+# --- Внутренние модули ---
+from services.config import PURCHASE_RATE, PURCHASE_BURST
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Асинхронный токен-бакет для ограничения частоты покупок одного отправителя.
+
+    Запас в burst токенов позволяет отправить пачку покупок подряд (например, в момент дропа),
+    а в долгую скорость не превышает rate покупок в секунду. При FloodWait/RetryAfter бакет
+    замирает на указанное Telegram время и снижает скорость вдвое, затем плавно её восстанавливает.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, min_rate: float | None = None):
+        """
+        :param name: Имя отправителя (для логов)
+        :param rate: Средняя скорость, токенов в секунду
+        :param burst: Ёмкость бакета (максимальная пачка подряд)
+        :param min_rate: Нижняя граница скорости после штрафов (по умолчанию rate / 10)
+        """
+        self.name = name
+        self.base_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate if min_rate is not None else rate / 10
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """
+        Ждёт, пока появится токен, и забирает его. Ожидающие обслуживаются по очереди.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def on_success(self) -> None:
+        """
+        Успешный запрос: скорость постепенно возвращается к базовой после штрафа.
+        """
+        if self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate + self.base_rate * 0.05)
+
+    def on_retry_after(self, seconds: float) -> None:
+        """
+        Telegram попросил подождать: пауза на seconds, бакет опустошается, скорость снижается вдвое.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0.0
+        self.rate = max(self.min_rate, self.rate / 2)
+        logger.warning(f"[{self.name}] Flood wait {seconds} сек., скорость покупок снижена до {self.rate:.2f}/сек.")
+
+
+_limiters: dict[str, TokenBucket] = {}
+
+
+def get_purchase_limiter(key: str) -> TokenBucket:
+    """
+    Возвращает общий лимитер покупок для отправителя.
+
+    :param key: Ключ отправителя, например "bot:<id бота>" или "userbot:<user_id>"
+    """
+    limiter = _limiters.get(key)
+    if limiter is None:
+        limiter = TokenBucket(key, rate=PURCHASE_RATE, burst=PURCHASE_BURST)
+        _limiters[key] = limiter
+    return limiter
@@ -0,0 +1,112 @@
+# --- Стандартные библиотеки ---
+import asyncio
+import logging
+
+# --- Сторонние библиотеки ---
+from pyrogram.utils import get_peer_id
+
+# --- Внутренние модули ---
+from services.config import get_valid_config, RECIPIENT_REFRESH_INTERVAL
+from services.userbot_pool import get_accounts
+
+logger = logging.getLogger(__name__)
+
+_bot_chats: dict[str, int] = {}  # "@username" канала → числовой chat_id для Bot API
+_userbot_peers: dict[tuple[str, int | str], int] = {}  # (сессия юзербота, получатель) → id пира в хранилище сессии
+_warmup_tasks: set[asyncio.Task] = set()
+
+
+def _normalize_username(target: str) -> str:
+    return target if target.startswith("@") else "@" + target
+
+
+def get_bot_chat_id(chat_id):
+    """
+    Возвращает числовой chat_id для получателя-канала, если он уже известен, иначе исходное значение.
+    """
+    if isinstance(chat_id, str):
+        return _bot_chats.get(_normalize_username(chat_id).lower(), chat_id)
+    return chat_id
+
+
+def get_userbot_peer(session_name: str, target):
+    """
+    Возвращает id уже разрешённого пира для аккаунта юзербота, иначе исходного получателя.
+    Pyrogram находит такой id в хранилище сессии без запроса к Telegram.
+    """
+    key = target.lower() if isinstance(target, str) else target
+    return _userbot_peers.get((session_name, key), target)
+
+
+async def _resolve_for_bot(bot, chat_id: str) -> None:
+    username = _normalize_username(chat_id)
+    try:
+        chat = await bot.get_chat(username)
+    except Exception as e:
+        logger.debug(f"Бот не смог разрешить получателя {username}: {e}")
+        return
+    _bot_chats[username.lower()] = chat.id
+
+
+async def _resolve_for_userbot(account, target) -> None:
+    try:
+        peer = await account.client.resolve_peer(target)
+        peer_id = get_peer_id(peer)
+    except Exception as e:
+        logger.debug(f"Аккаунт {account.name} не смог разрешить получателя {target}: {e}")
+        return
+    key = target.lower() if isinstance(target, str) else target
+    _userbot_peers[(account.name, key)] = peer_id
+
+
+async def warm_recipient(bot, owner_id: int, target_user_id: int | None, target_chat_id: str | None) -> None:
+    """
+    Разрешает получателя заранее: для бота — username канала в числовой id,
+    для каждого аккаунта юзербота — пира в хранилище его сессии.
+
+    :param bot: Экземпляр aiogram Bot
+    :param owner_id: Telegram ID владельца конфига (пул юзерботов)
+    :param target_user_id: ID получателя-пользователя (или None)
+    :param target_chat_id: @username или ID получателя-чата (или None)
+    """
+    target = target_user_id if target_user_id is not None else target_chat_id
+    if target is None:
+        return
+    jobs = [_resolve_for_userbot(account, target) for account in get_accounts(owner_id) if account.healthy]
+    if isinstance(target_chat_id, str) and target_user_id is None:
+        jobs.append(_resolve_for_bot(bot, target_chat_id))
+    await asyncio.gather(*jobs)
+
+
+def schedule_warmup(bot, owner_id: int, target_user_id: int | None, target_chat_id: str | None) -> None:
+    """
+    Запускает warm_recipient в фоне, не задерживая ответ пользователю.
+    """
+    task = asyncio.create_task(warm_recipient(bot, owner_id, target_user_id, target_chat_id))
+    _warmup_tasks.add(task)
+    task.add_done_callback(_warmup_tasks.discard)
+
+
+async def warm_profile_recipients(bot, owner_id: int) -> None:
+    """
+    Разрешает получателей всех профилей владельца.
+    """
+    config = await get_valid_config(owner_id)
+    targets = {
+        (profile.get("TARGET_USER_ID"), profile.get("TARGET_CHAT_ID"))
+        for profile in config.get("PROFILES", [])
+    }
+    await asyncio.gather(*(warm_recipient(bot, owner_id, user, chat) for user, chat in targets))
+
+
+async def recipients_refresher(bot, owner_id: int) -> None:
+    """
+    Фоновая задача: разрешает получателей профилей при старте и затем раз в RECIPIENT_REFRESH_INTERVAL секунд,
+    чтобы к моменту дропа первая покупка ушла без дополнительного запроса к Telegram.
+    """
+    while True:
+        try:
+            await warm_profile_recipients(bot, owner_id)
+        except Exception as e:
+            logger.error(f"Ошибка обновления получателей: {e}")
+        await asyncio.sleep(RECIPIENT_REFRESH_INTERVAL)
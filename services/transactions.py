@@ -0,0 +1,176 @@
+# --- Стандартные библиотеки ---
+import asyncio
+import logging
+
+# --- Сторонние библиотеки ---
+from pymongo import ASCENDING, DESCENDING
+
+# --- Внутренние модули ---
+from services.db import get_star_transactions_collection, get_star_sync_collection
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 100  # Максимальный размер страницы getStarTransactions
+
+_sync_locks: dict[int, asyncio.Lock] = {}  # Блокировки синхронизации по id бота
+
+
+async def ensure_transaction_indexes() -> None:
+    """
+    Создаёт индексы коллекции транзакций звёзд (вызывается при старте бота).
+    """
+    col = get_star_transactions_collection()
+    await col.create_index([("bot_id", ASCENDING), ("kind", ASCENDING), ("txn_id", ASCENDING)], unique=True)
+    await col.create_index([("bot_id", ASCENDING), ("kind", ASCENDING), ("user_id", ASCENDING), ("refunded", ASCENDING)])
+    await col.create_index([("bot_id", ASCENDING), ("kind", ASCENDING), ("refunded", ASCENDING), ("amount", DESCENDING)])
+
+
+def _transaction_doc(bot_id: int, txn) -> dict:
+    """
+    Преобразует StarTransaction из aiogram в документ MongoDB.
+    Входящие транзакции (source задан) — депозиты, исходящие — возвраты и списания.
+    """
+    kind = "deposit" if txn.source is not None else "outgoing"
+    user = getattr(txn.source, "user", None) if txn.source is not None else None
+    if user is None and txn.receiver is not None:
+        user = getattr(txn.receiver, "user", None)
+    date = getattr(txn, "date", None)
+    return {
+        "_id": f"{bot_id}:{kind}:{txn.id}",
+        "bot_id": bot_id,
+        "kind": kind,
+        "txn_id": txn.id,
+        "amount": txn.amount,
+        "date": date.timestamp() if hasattr(date, "timestamp") else date,
+        "user_id": getattr(user, "id", None),
+        "username": getattr(user, "username", None),
+    }
+
+
+async def _store_page(bot_id: int, txns: list) -> int:
+    """
+    Сохраняет страницу транзакций и помечает депозиты, по которым прошёл возврат.
+
+    :return: Изменение баланса по этой странице
+    """
+    col = get_star_transactions_collection()
+    delta = 0
+    refunded_ids = []
+    for txn in txns:
+        doc = _transaction_doc(bot_id, txn)
+        if doc["kind"] == "deposit":
+            delta += doc["amount"]
+            # Флаг refunded мог быть выставлен раньше (mark_refunded) — не затираем его
+            await col.update_one(
+                {"_id": doc["_id"]},
+                {"$set": doc, "$setOnInsert": {"refunded": False}},
+                upsert=True
+            )
+        else:
+            delta -= doc["amount"]
+            refunded_ids.append(doc["txn_id"])
+            await col.update_one({"_id": doc["_id"]}, {"$set": doc}, upsert=True)
+    if refunded_ids:
+        await col.update_many(
+            {"bot_id": bot_id, "kind": "deposit", "txn_id": {"$in": refunded_ids}},
+            {"$set": {"refunded": True}}
+        )
+    return delta
+
+
+async def _reset_transactions(bot_id: int) -> None:
+    """
+    Удаляет сохранённую историю бота перед полной пересинхронизацией.
+    """
+    await get_star_transactions_collection().delete_many({"bot_id": bot_id})
+    await get_star_sync_collection().delete_one({"_id": bot_id})
+
+
+async def sync_star_transactions(bot) -> dict:
+    """
+    Догружает в MongoDB новые транзакции звёзд бота.
+
+    Telegram отдаёт транзакции в хронологическом порядке, поэтому курсор (offset и id последней
+    транзакции) хранится в коллекции star_sync, и запрашиваются только страницы после него.
+    Если транзакция перед курсором не совпала с сохранённой, история загружается заново.
+
+    :param bot: Экземпляр aiogram Bot
+    :return: Состояние синхронизации {"offset", "last_id", "balance"}
+    """
+    lock = _sync_locks.setdefault(bot.id, asyncio.Lock())
+    async with lock:
+        sync_col = get_star_sync_collection()
+        state = await sync_col.find_one({"_id": bot.id}) or {"offset": 0, "last_id": None, "balance": 0}
+        offset = state["offset"]
+        last_id = state["last_id"]
+        balance = state["balance"]
+
+        # Перекрываем курсор на одну транзакцию, чтобы убедиться, что история не сдвинулась
+        fetch_offset = max(offset - 1, 0)
+        check_cursor = offset > 0
+        fetched = 0
+        while True:
+            res = await bot.get_star_transactions(offset=fetch_offset, limit=PAGE_SIZE)
+            page = res.transactions
+            fetch_offset += len(page)
+            txns = page
+            if check_cursor:
+                check_cursor = False
+                if not page or page[0].id != last_id:
+                    logger.warning(f"История транзакций бота {bot.id} не совпала с курсором, загружаем заново.")
+                    await _reset_transactions(bot.id)
+                    offset, last_id, balance = 0, None, 0
+                    fetch_offset = 0
+                    continue
+                txns = page[1:]
+
+            if txns:
+                balance += await _store_page(bot.id, txns)
+                offset += len(txns)
+                last_id = txns[-1].id
+                fetched += len(txns)
+                # Сохраняем курсор после каждой страницы: при сбое продолжим с того же места
+                await sync_col.update_one(
+                    {"_id": bot.id},
+                    {"$set": {"offset": offset, "last_id": last_id, "balance": balance}},
+                    upsert=True
+                )
+
+            if len(page) < PAGE_SIZE:
+                break
+
+        if fetched:
+            logger.info(f"Синхронизировано {fetched} новых транзакций звёзд бота {bot.id}.")
+        return {"offset": offset, "last_id": last_id, "balance": balance}
+
+
+async def get_transactions_balance(bot) -> int:
+    """
+    Возвращает баланс звёзд бота по сохранённым транзакциям (с догрузкой новых).
+    """
+    state = await sync_star_transactions(bot)
+    return state["balance"]
+
+
+async def get_unrefunded_deposits(bot, user_id: int) -> list[dict]:
+    """
+    Возвращает депозиты без возврата, совершённые пользователем с указанным Telegram ID.
+    """
+    col = get_star_transactions_collection()
+    return await col.find(
+        {"bot_id": bot.id, "kind": "deposit", "user_id": user_id, "refunded": False}
+    ).to_list(length=None)
+
+
+async def mark_refunded(bot, txn_ids: list[str]) -> None:
+    """
+    Помечает депозиты как возвращённые сразу после успешного refund_star_payment,
+    не дожидаясь, пока возврат придёт следующей страницей транзакций.
+    """
+    if not txn_ids:
+        return
+    col = get_star_transactions_collection()
+    await col.update_many(
+        {"bot_id": bot.id, "kind": "deposit", "txn_id": {"$in": list(txn_ids)}},
+        {"$set": {"refunded": True}}
+    )
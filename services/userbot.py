@@ -18,7 +18,8 @@ from pyrogram.errors import (
 )
 
 # --- Внутренние библиотеки ---
-from services.config import get_valid_config, save_config
+from services.config import get_valid_config, save_config, update_config, userbot_account_field
+from services.userbot_pool import register_account, unregister_account
 from utils.proxy import get_userbot_proxy
 
 logger = logging.getLogger(__name__)
@@ -93,6 +94,8 @@ async def try_start_userbot_from_config(user_id: int):
                 "client": app,
                 "started": True,
             }
+            register_account(user_id, session_name, app, "userbot")
+            await start_extra_userbot_accounts(user_id)
 
             return True
 
@@ -126,6 +129,44 @@ async def try_start_userbot_from_config(user_id: int):
     return False
 
 
+async def start_extra_userbot_accounts(user_id: int) -> int:
+    """
+    Запускает дополнительные аккаунты юзербота из USERBOT.ACCOUNTS и добавляет их в пул.
+    Аккаунты используют API_ID/API_HASH основного аккаунта и уже авторизованные файлы сессий.
+
+    :return: Количество запущенных дополнительных аккаунтов
+    """
+    config = await get_valid_config(user_id)
+    userbot_data = config.get("USERBOT", {})
+    started = 0
+    for index, account in enumerate(userbot_data.get("ACCOUNTS", [])):
+        session_name = account.get("SESSION")
+        if not session_name:
+            continue
+        session_path = os.path.join(sessions_dir, f"{session_name}.session")
+        if not os.path.exists(session_path):
+            logger.error(f"Файл сессии дополнительного аккаунта {session_name} не найден.")
+            continue
+        app = await create_userbot_client(
+            user_id, session_name, userbot_data["API_ID"], userbot_data["API_HASH"],
+            account.get("PHONE"), sessions_dir, None
+        )
+        try:
+            await app.start()
+            me = await app.get_me()
+        except Exception as e:
+            logger.error(f"Не удалось запустить дополнительный аккаунт {session_name}: {e}")
+            continue
+        register_account(user_id, session_name, app, f"userbot:{session_name}")
+        await update_config(user_id, set_fields={
+            userbot_account_field(index, "USER_ID"): me.id,
+            userbot_account_field(index, "USERNAME"): me.username,
+        })
+        logger.info(f"Дополнительный аккаунт авторизован: {me.first_name} ({me.id})")
+        started += 1
+    return started
+
+
 async def _clear_userbot_config(user_id: int):
     """
     Сбрасывает поля USERBOT в конфиге.
@@ -281,6 +322,7 @@ async def continue_userbot_signin(message, state):
             "client": app,
             "started": True,
         }
+        register_account(user_id, f"userbot_{user_id}", app, "userbot")
 
         # Сохраняем данные
         config = await get_valid_config(user_id)
@@ -358,6 +400,7 @@ async def finish_userbot_signin(message, state):
             "client": app,
             "started": True,
         }
+        register_account(user_id, f"userbot_{user_id}", app, "userbot")
 
         # Сохраняем данные
         config = await get_valid_config(user_id)
@@ -419,6 +462,19 @@ async def get_userbot_client(user_id: int) -> bool:
     return app
     
 
+async def stop_userbot(user_id: int) -> None:
+    """
+    Останавливает все клиенты юзербота владельца, не трогая сессии и конфиг
+    (например, когда владелец переходит к другому процессу-воркеру).
+    """
+    for entry in unregister_account(user_id):
+        try:
+            await entry.client.stop()
+        except Exception as e:
+            logger.error(f"Ошибка при остановке аккаунта {entry.name}: {e}")
+    _clients.pop(user_id, None)
+
+
 async def delete_userbot_session(user_id: int) -> bool:
     """
     Полностью удаляет userbot-сессию: останавливает клиента, удаляет файлы и очищает конфиг.
@@ -452,6 +508,15 @@ async def delete_userbot_session(user_id: int) -> bool:
         except Exception as e:
             logger.error(f"Не удалось удалить журнал: {e}")
 
+    # Останавливаем дополнительные аккаунты пула
+    for entry in unregister_account(user_id):
+        if entry.is_primary:
+            continue  # Основной клиент уже остановлен выше
+        try:
+            await entry.client.stop()
+        except Exception as e:
+            logger.error(f"Ошибка при остановке аккаунта {entry.name}: {e}")
+
     # Очищаем конфиг
     await _clear_userbot_config(user_id)
 
@@ -0,0 +1,86 @@
+# --- Стандартные библиотеки ---
+import asyncio
+import logging
+import random
+import time
+
+# --- Сторонние библиотеки ---
+from pyrogram.errors import FloodWait
+from pyrogram.raw.functions import Ping
+
+# --- Внутренние модули ---
+from services.config import USERBOT_PING_INTERVAL, USERBOT_PING_TIMEOUT, USERBOT_RECONNECT_MAX_DELAY
+from services.userbot_pool import UserbotAccount, get_accounts
+
+logger = logging.getLogger(__name__)
+
+
+async def ping_account(account: UserbotAccount) -> float:
+    """
+    Отправляет MTProto ping через клиент аккаунта.
+
+    :return: Время ответа (RTT) в секундах
+    """
+    started = time.monotonic()
+    await asyncio.wait_for(
+        account.client.invoke(Ping(ping_id=random.getrandbits(63))),
+        USERBOT_PING_TIMEOUT
+    )
+    return time.monotonic() - started
+
+
+async def reconnect_account(account: UserbotAccount) -> None:
+    """
+    Перезапускает клиент аккаунта (stop + start).
+    """
+    try:
+        await asyncio.wait_for(account.client.stop(), USERBOT_PING_TIMEOUT)
+    except Exception as e:
+        logger.debug(f"Остановка клиента {account.name} перед переподключением: {e}")
+    await asyncio.wait_for(account.client.start(), USERBOT_PING_TIMEOUT * 3)
+
+
+async def check_account(account: UserbotAccount) -> bool:
+    """
+    Проверяет соединение аккаунта, а у недоступного аккаунта сначала пробует переподключиться.
+
+    :return: True, если аккаунт доступен после проверки
+    """
+    try:
+        if not account.healthy:
+            logger.info(f"Переподключение аккаунта юзербота {account.name} (попытка {account.failures + 1})...")
+            await reconnect_account(account)
+        rtt = await ping_account(account)
+    except FloodWait as e:
+        # Соединение живо, просто Telegram просит подождать
+        account.on_flood_wait(e.value)
+        account.on_ping_ok(account.rtt or 0.0, USERBOT_PING_INTERVAL)
+        return True
+    except Exception as e:
+        account.on_ping_failed(str(e) or type(e).__name__, USERBOT_PING_INTERVAL, USERBOT_RECONNECT_MAX_DELAY)
+        logger.warning(f"Аккаунт юзербота {account.name} не отвечает ({account.last_error}), "
+                       f"следующая проверка через {account.next_check - time.monotonic():.0f} сек.")
+        return False
+
+    account.on_ping_ok(rtt, USERBOT_PING_INTERVAL)
+    logger.debug(f"Ping {account.name}: {rtt * 1000:.0f} мс")
+    return True
+
+
+async def userbot_supervisor(user_id: int) -> None:
+    """
+    Фоновая задача: проверяет соединение всех аккаунтов юзербота владельца.
+
+    - Живые аккаунты пингуются раз в USERBOT_PING_INTERVAL секунд, RTT сохраняется в аккаунте.
+    - Аккаунт без ответа помечается недоступным, и покупки идут через остальные аккаунты пула.
+    - Недоступный аккаунт переподключается с экспоненциальной паузой до USERBOT_RECONNECT_MAX_DELAY.
+    """
+    while True:
+        try:
+            now = time.monotonic()
+            due = [account for account in get_accounts(user_id) if account.next_check <= now]
+            if due:
+                await asyncio.gather(*(check_account(account) for account in due))
+        except Exception as e:
+            logger.error(f"Ошибка супервизора юзербота: {e}")
+        await asyncio.sleep(min(USERBOT_PING_INTERVAL, 5))
@@ -0,0 +1,158 @@
+# --- Стандартные библиотеки ---
+import logging
+import time
+
+# --- Внутренние модули ---
+from services.rate_limiter import get_purchase_limiter
+
+logger = logging.getLogger(__name__)
+
+
+class UserbotAccount:
+    """
+    Один Telegram-аккаунт в пуле юзерботов владельца.
+
+    У каждого аккаунта свой Pyrogram Client, свой баланс звёзд (леджер account),
+    свой лимитер покупок и своё состояние: после FloodWait аккаунт выводится
+    из ротации до окончания паузы, остальные аккаунты продолжают покупать.
+    """
+
+    def __init__(self, owner_id: int, name: str, client, account: str):
+        """
+        :param owner_id: Telegram ID владельца конфига
+        :param name: Имя сессии (уникально в пределах владельца)
+        :param client: Запущенный Pyrogram Client
+        :param account: Имя счёта для services.balance.get_ledger ("userbot" или "userbot:<имя сессии>")
+        """
+        self.owner_id = owner_id
+        self.name = name
+        self.client = client
+        self.account = account
+        self.limiter = get_purchase_limiter(f"userbot:{name}")
+        self.healthy = True
+        self.in_flight = 0  # Покупки, отправляемые через аккаунт прямо сейчас
+        self.sent = 0
+        self.rtt: float | None = None  # Время последнего ping в секундах
+        self.failures = 0  # Неудачные проверки соединения подряд
+        self.last_error: str | None = None
+        self.last_ok: float | None = None  # time.time() последней успешной проверки
+        self.next_check = 0.0  # time.monotonic() следующей проверки супервизором
+        self._flood_until = 0.0
+
+    @property
+    def is_primary(self) -> bool:
+        return self.account == "userbot"
+
+    @property
+    def available(self) -> bool:
+        """
+        Аккаунт здоров и не ждёт окончания FloodWait.
+        """
+        return self.healthy and time.monotonic() >= self._flood_until
+
+    def on_flood_wait(self, seconds: float) -> None:
+        """
+        Выводит аккаунт из ротации на seconds и передаёт паузу его лимитеру.
+        """
+        self._flood_until = max(self._flood_until, time.monotonic() + seconds)
+        self.limiter.on_retry_after(seconds)
+
+    def set_healthy(self, healthy: bool) -> None:
+        if self.healthy != healthy:
+            logger.info(f"Аккаунт юзербота {self.name}: {'доступен' if healthy else 'недоступен'}")
+        self.healthy = healthy
+
+    def on_ping_ok(self, rtt: float, interval: float) -> None:
+        """
+        Соединение живо: сбрасывает счётчик ошибок и планирует следующую проверку.
+        """
+        self.rtt = rtt
+        self.failures = 0
+        self.last_error = None
+        self.last_ok = time.time()
+        self.next_check = time.monotonic() + interval
+        self.set_healthy(True)
+
+    def on_ping_failed(self, error: str, interval: float, max_delay: float) -> None:
+        """
+        Соединение потеряно: аккаунт выводится из ротации, следующая попытка — с экспоненциальной паузой.
+        """
+        self.failures += 1
+        self.last_error = error
+        self.next_check = time.monotonic() + min(max_delay, interval * 2 ** (self.failures - 1))
+        self.set_healthy(False)
+
+    def mark_disconnected(self, error: str) -> None:
+        """
+        Ошибка соединения при покупке: аккаунт выводится из ротации до переподключения супервизором.
+        """
+        self.last_error = error
+        self.next_check = 0.0  # Супервизор проверит аккаунт на ближайшем проходе
+        self.set_healthy(False)
+
+    def health(self) -> dict:
+        """
+        Состояние аккаунта для отображения и логов.
+        """
+        return {
+            "name": self.name,
+            "primary": self.is_primary,
+            "healthy": self.healthy,
+            "available": self.available,
+            "rtt": self.rtt,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_ok": self.last_ok,
+            "in_flight": self.in_flight,
+            "sent": self.sent,
+        }
+
+
+_pools: dict[int, dict[str, UserbotAccount]] = {}  # Аккаунты юзерботов по user_id владельца
+
+
+def register_account(owner_id: int, name: str, client, account: str) -> UserbotAccount:
+    """
+    Добавляет (или заменяет) запущенный аккаунт в пуле владельца.
+    """
+    entry = UserbotAccount(owner_id, name, client, account)
+    _pools.setdefault(owner_id, {})[name] = entry
+    logger.info(f"Аккаунт юзербота {name} добавлен в пул (аккаунтов: {len(_pools[owner_id])})")
+    return entry
+
+
+def unregister_account(owner_id: int, name: str | None = None) -> list[UserbotAccount]:
+    """
+    Убирает из пула один аккаунт или, если name не задан, все аккаунты владельца.
+
+    :return: Удалённые аккаунты (клиенты останавливает вызывающий код)
+    """
+    pool = _pools.get(owner_id, {})
+    if name is None:
+        _pools.pop(owner_id, None)
+        return list(pool.values())
+    entry = pool.pop(name, None)
+    return [entry] if entry else []
+
+
+def get_accounts(owner_id: int) -> list[UserbotAccount]:
+    """
+    Возвращает все аккаунты владельца, основной — первым.
+    """
+    return sorted(_pools.get(owner_id, {}).values(), key=lambda a: not a.is_primary)
+
+
+def get_available_accounts(owner_id: int) -> list[UserbotAccount]:
+    """
+    Возвращает доступные аккаунты владельца от наименее загруженного к наиболее.
+    При равной загрузке первым идёт аккаунт с меньшим числом отправленных подарков.
+    """
+    accounts = [a for a in _pools.get(owner_id, {}).values() if a.available]
+    return sorted(accounts, key=lambda a: (a.in_flight, a.sent))
+
+
+def get_pool_health(owner_id: int) -> list[dict]:
+    """
+    Возвращает состояние всех аккаунтов юзербота владельца.
+    """
+    return [account.health() for account in get_accounts(owner_id)]
@@ -0,0 +1,495 @@
+# --- Стандартные библиотеки ---
+import asyncio
+import logging
+
+# --- Внутренние модули ---
+from services.config import (
+    get_valid_config,
+    get_active_owner_ids,
+    is_owner_active,
+    invalidate_config_cache,
+    update_config,
+    increment_profile_stats,
+    profile_field,
+    get_target_display,
+    get_target_display_local,
+    set_config_cache_ttl,
+    ENGINE_MAX_CONCURRENT_OWNERS,
+    ENGINE_DISCOVERY_INTERVAL,
+    WORKER_ACTIVE_TIMEOUT,
+    LEASE_RENEW_INTERVAL,
+    SHARDED_CONFIG_CACHE_TTL
+)
+from services.menu import update_menu
+from services.events import (
+    clear_wakeup, wait_for_wakeup, pop_new_gifts, register_worker, unregister_worker,
+    take_notified_owners, wait_for_engine_wakeup
+)
+from services.catalog import CatalogSnapshot, is_gift_available, SOLD_OUT
+from services.balance import refresh_balance
+from services.gifts_manager import get_best_gift_list
+from services.buy_bot import buy_gift
+from services.buy_userbot import buy_gift_userbot, buy_gifts_userbot_batch
+from services.orders import get_owners_with_orders, has_pending_orders, take_order, finish_order, purchase_result_text
+from services.userbot import is_userbot_active, try_start_userbot_from_config, stop_userbot
+from services.lease import WORKER_ID, ensure_lease_indexes, claim_owner, renew_leases, release_owner, holds_lease
+from services.userbot_health import userbot_supervisor
+from services.recipients import recipients_refresher
+
+logger = logging.getLogger(__name__)
+
+_owner_tasks: dict[int, list[asyncio.Task]] = {}  # Фоновые задачи по user_id владельца
+_owner_locks: dict[int, asyncio.Lock] = {}  # Подключение и отключение владельца не пересекаются
+_engine_clients: set[int] = set()  # Владельцы, чей юзербот запустил движок (его же движок и останавливает)
+_owner_slots: asyncio.Semaphore | None = None  # Ограничение одновременных проходов владельцев
+_sharded = False  # Владельцы делятся между процессами через аренду (services.lease)
+
+
+def format_profile_report(owner_id: int, profile_index: int, profile: dict, purchases: list[dict], done: bool) -> list[str]:
+    """
+    Формирует строки отчёта по профилю: заголовок, получатель, траты и сводку покупок.
+    """
+    COUNT = profile["COUNT"]
+    LIMIT = profile.get("LIMIT", 0)
+    target_display = get_target_display(profile, owner_id)
+    title = (f"\n┌✅ <b>Профиль {profile_index+1}</b>\n" if done
+             else f"\n┌⚠️ <b>Профиль {profile_index+1}</b> (частично)\n")
+    summary_lines = [
+        title +
+        f"├👤 <b>Получатель:</b> {target_display}\n"
+        f"├💸 <b>Потрачено:</b> {profile['SPENT']:,} / {LIMIT:,} ★\n"
+        f"└🎁 <b>Куплено </b>{profile['BOUGHT']} из {COUNT}:"
+    ]
+    gift_summary = {}
+    for p in purchases:
+        key = p["id"]
+        if key not in gift_summary:
+            gift_summary[key] = {"price": p["price"], "count": 0}
+        gift_summary[key]["count"] += 1
+
+    gift_items = list(gift_summary.items())
+    for idx, (gid, data) in enumerate(gift_items):
+        prefix = "   └" if idx == len(gift_items) - 1 else "   ├"
+        summary_lines.append(
+            f"{prefix} {data['price']:,} ★ × {data['count']}"
+        )
+    return summary_lines
+
+
+async def process_profile(bot, owner_id: int, config: dict, profile_index: int, drop_catalog: CatalogSnapshot | None) -> dict:
+    """
+    Покупает подарки по одному профилю.
+
+    :return: Словарь с ключами:
+             success — не было неудачных покупок;
+             progress — профиль завершён или продвинулся (нужен отчёт);
+             lines — строки отчёта по профилю.
+    """
+    result = {"success": True, "progress": False, "lines": []}
+    profile = config["PROFILES"][profile_index]
+    sender = profile.get("SENDER", "bot")
+
+    COUNT = profile["COUNT"]
+    LIMIT = profile.get("LIMIT", 0)
+    TARGET_USER_ID = profile["TARGET_USER_ID"]
+    TARGET_CHAT_ID = profile["TARGET_CHAT_ID"]
+
+    if drop_catalog is not None:
+        filtered_gifts = drop_catalog.select_for_profile(profile)
+    else:
+        filtered_gifts = await get_best_gift_list(profile)
+
+    if not filtered_gifts:
+        return result
+
+    purchases = []
+    interrupted = False
+    before_bought = profile["BOUGHT"]
+    before_spent = profile["SPENT"]
+
+    for gift in filtered_gifts:
+        gift_id = gift.id
+        gift_price = gift.price
+        sticker_file_id = gift.sticker_file_id
+
+        # Проверяем лимит и остаток подарка перед каждой покупкой
+        while (profile["BOUGHT"] < COUNT and
+               profile["SPENT"] + gift_price <= LIMIT and
+               is_gift_available(gift)):
+
+            if _sharded and not holds_lease(owner_id):
+                # Аренда могла перейти к другому процессу — прекращаем проход, не дожидаясь его конца
+                logger.warning(f"[{owner_id}] Аренда владельца не подтверждена, проход покупок прерван")
+                interrupted = True
+                break
+
+            if _sharded and not await is_owner_active(owner_id):
+                # Покупки выключили в другом процессе, а кеш конфига ещё не истёк
+                logger.info(f"[{owner_id}] Покупки выключены, проход покупок прерван")
+                invalidate_config_cache(owner_id)
+                interrupted = True
+                break
+
+            if sender == "bot":
+                success = await buy_gift(
+                    bot=bot,
+                    env_user_id=owner_id,
+                    gift_id=gift_id,
+                    user_id=TARGET_USER_ID,
+                    chat_id=TARGET_CHAT_ID,
+                    gift_price=gift_price,
+                    file_id=sticker_file_id
+                )
+            elif sender == "userbot":
+                success = await buy_gift_userbot(
+                    session_user_id=owner_id,
+                    gift_id=gift_id,
+                    target_user_id=TARGET_USER_ID,
+                    target_chat_id=TARGET_CHAT_ID,
+                    gift_price=gift_price,
+                    file_id=sticker_file_id
+                )
+            else:
+                logger.warning(f"Неизвестный отправитель SENDER={sender} в профиле {profile_index}")
+                success = False
+
+            if success is SOLD_OUT:
+                break  # Подарок распродан — это не ошибка покупки, пробуем следующий
+
+            if not success:
+                result["success"] = False
+                break  # Не удалось купить — пробуем следующий подарок
+
+            profile = await increment_profile_stats(
+                owner_id, profile_index, bought=1, spent=gift_price
+            )
+            purchases.append({"id": gift_id, "price": gift_price})
+
+            # Проверяем: не достигли ли лимит после покупки
+            if profile["SPENT"] >= LIMIT:
+                break
+
+        if interrupted or profile["BOUGHT"] >= COUNT or profile["SPENT"] >= LIMIT:
+            break  # Достигли лимит либо по количеству, либо по сумме (или проход прерван)
+
+    made_local_progress = (profile["BOUGHT"] > before_bought) or (profile["SPENT"] > before_spent)
+
+    # Профиль полностью выполнен: либо по количеству, либо по лимиту
+    if (profile["BOUGHT"] >= COUNT or profile["SPENT"] >= LIMIT) and not profile["DONE"]:
+        config = await update_config(
+            owner_id, set_fields={profile_field(profile_index, "DONE"): True}
+        )
+        profile = config["PROFILES"][profile_index]
+        result["lines"] = format_profile_report(owner_id, profile_index, profile, purchases, done=True)
+        result["progress"] = True
+        logger.info(f"Профиль #{profile_index+1} завершён")
+        await refresh_balance(bot, user_id=owner_id)
+        return result
+
+    # Если ничего не куплено — баланс/лимит/подарки кончились
+    if (profile["BOUGHT"] < COUNT or profile["SPENT"] < LIMIT) and not profile["DONE"] and made_local_progress:
+        result["lines"] = format_profile_report(owner_id, profile_index, profile, purchases, done=False)
+        result["progress"] = True
+        logger.warning(f"Профиль #{profile_index+1} не завершён")
+        await refresh_balance(bot, user_id=owner_id)
+
+    return result
+
+
+async def process_sender_group(bot, owner_id: int, config: dict, profile_indexes: list[int], drop_catalog: CatalogSnapshot | None) -> list[tuple[int, dict]]:
+    """
+    Последовательно обрабатывает профили одного отправителя (бот или юзербот).
+    Группы разных отправителей работают параллельно: у них разные аккаунты и лимитеры.
+    """
+    results = []
+    for profile_index in profile_indexes:
+        try:
+            results.append((profile_index, await process_profile(bot, owner_id, config, profile_index, drop_catalog)))
+        except Exception as e:
+            logger.error(f"[{owner_id}] Ошибка обработки профиля #{profile_index+1}: {e}")
+    return results
+
+
+async def run_owner_pass(bot, owner_id: int, config: dict) -> bool:
+    """
+    Один проход покупок владельца: профили группируются по отправителю (SENDER),
+    бот и юзербот покупают одновременно, внутри группы профили обрабатываются по очереди.
+
+    :return: True, если нужно сразу выполнить ещё один проход (был прогресс или быстрый проход по новинкам)
+    """
+    # Быстрый путь: только что появившиеся подарки покупаем отдельным проходом,
+    # не дожидаясь полного каталога по каждому профилю
+    new_gifts = pop_new_gifts(owner_id)
+    drop_catalog = CatalogSnapshot(new_gifts, source="drop") if new_gifts else None
+
+    # Группируем незавершённые профили по отправителю
+    groups: dict[str, list[int]] = {}
+    for profile_index, profile in enumerate(config["PROFILES"]):
+        # Пропускаем завершённые профили
+        if profile.get("DONE"):
+            continue
+        # Пропускаем профили с выключенным юзерботом
+        sender = profile.get("SENDER", "bot")
+        if sender == "userbot":
+            userbot_config = config.get("USERBOT", {})
+            if not userbot_config.get("ENABLED", False):
+                continue
+        groups.setdefault(sender, []).append(profile_index)
+
+    group_results = await asyncio.gather(*(
+        process_sender_group(bot, owner_id, config, indexes, drop_catalog)
+        for indexes in groups.values()
+    ))
+    results = sorted((r for group in group_results for r in group), key=lambda r: r[0])
+
+    report_message_lines = []
+    progress_made = False  # Был ли прогресс по профилям на этом проходе
+    any_success = True
+    for _, result in results:
+        any_success = any_success and result["success"]
+        if result["progress"]:
+            progress_made = True
+            report_message_lines += result["lines"]
+
+    config = await get_valid_config(owner_id)
+
+    if not any_success and not progress_made:
+        logger.warning(
+            "Не удалось купить ни один подарок ни в одном профиле (все попытки buy_gift были неудачны)"
+        )
+        config = await update_config(owner_id, set_fields={"ACTIVE": False})
+        text = ("⚠️ Найдены подходящие подарки, но <b>не удалось</b> купить."
+                "\n💰 Пополните баланс! Проверьте адрес получателя!"
+                "\n🚦 Статус изменён на 🔴 (неактивен).")
+        message = await bot.send_message(chat_id=owner_id, text=text)
+        await update_menu(
+            bot=bot, chat_id=owner_id, user_id=owner_id, message_id=message.message_id
+        )
+
+    # После обработки всех профилей:
+    if progress_made:
+        config = await update_config(owner_id, set_fields={
+            "ACTIVE": not all(p.get("DONE") for p in config["PROFILES"])
+        })
+        logger.info("Отчёт: хотя бы один профиль обработан, отправляем сводку.")
+        text = "🍀 <b>Отчёт по профилям:</b>\n"
+        text += "\n".join(report_message_lines) if report_message_lines else "⚠️ Покупок не совершено."
+        message = await bot.send_message(chat_id=owner_id, text=text)
+        await update_menu(
+            bot=bot, chat_id=owner_id, user_id=owner_id, message_id=message.message_id
+        )
+
+    if all(p.get("DONE") for p in config["PROFILES"]) and config["ACTIVE"]:
+        config = await update_config(owner_id, set_fields={"ACTIVE": False})
+        text = "✅ Все профили <b>завершены</b>!\n⚠️ Нажмите ♻️ <b>Сбросить</b> или ✏️ <b>Изменить</b>!"
+        message = await bot.send_message(chat_id=owner_id, text=text)
+        await update_menu(
+            bot=bot, chat_id=owner_id, user_id=owner_id, message_id=message.message_id
+        )
+
+    # После успешного или быстрого прохода сразу проверяем, не осталось ли ещё что купить
+    return progress_made or drop_catalog is not None
+
+
+
+async def owner_worker(bot, owner_id: int) -> None:
+    """
+    Фоновый воркер покупок одного владельца.
+    Учитывает параметр LIMIT — максимальную сумму звёзд, которую можно потратить на профиль.
+    Если лимит исчерпан — профиль считается завершённым и воркер переходит к следующему.
+
+    Когда покупки выключаются (ACTIVE=False), воркер завершается и отключает владельца
+    (stop_owner): задачи, запущенный движком юзербот и аренда освобождаются.
+    Включение покупок снова подключает владельца через purchase_engine.
+    Проход покупок выполняется в одном из ENGINE_MAX_CONCURRENT_OWNERS слотов движка:
+    слоты выдаются по очереди, поэтому активные владельцы обслуживаются по кругу.
+    Ошибки одного владельца не затрагивают остальных.
+    """
+    try:
+        await refresh_balance(bot, user_id=owner_id)
+    except Exception as e:
+        logger.error(f"[{owner_id}] Не удалось обновить баланс: {e}")
+
+    while True:
+        clear_wakeup(owner_id)
+        try:
+            if not _sharded or holds_lease(owner_id):
+                await process_orders(bot, owner_id)
+
+            config = await get_valid_config(owner_id)
+
+            if not config["ACTIVE"]:
+                break
+
+            if _sharded and not holds_lease(owner_id):
+                # Аренда не продлена: пока не подтвердим её, покупки не выполняем
+                await wait_for_wakeup(owner_id, timeout=LEASE_RENEW_INTERVAL)
+                continue
+
+            async with _get_owner_slots():
+                again = await run_owner_pass(bot, owner_id, config)
+            if again:
+                continue
+
+        except Exception as e:
+            logger.error(f"[{owner_id}] Ошибка в воркере покупок: {e}")
+
+        await wait_for_wakeup(owner_id, timeout=WORKER_ACTIVE_TIMEOUT)
+
+    pop_new_gifts(owner_id)  # Пропущенные новинки попадут в обычный проход после включения
+    await stop_owner(owner_id)
+
+
+async def process_orders(bot, owner_id: int) -> None:
+    """
+    Выполняет заказы на покупку юзерботом, поставленные из каталога другим процессом (services.orders).
+    """
+    while True:
+        order = await take_order(owner_id, WORKER_ID)
+        if order is None:
+            return
+        bought = 0
+        try:
+            summary = await buy_gifts_userbot_batch(
+                session_user_id=owner_id,
+                gift_id=order["gift_id"],
+                target_user_id=order["target_user_id"],
+                target_chat_id=order["target_chat_id"],
+                gift_price=order["gift_price"],
+                quantity=order["quantity"]
+            )
+            bought = summary["bought"]
+        except Exception as e:
+            logger.error(f"[{owner_id}] Ошибка выполнения заказа {order['_id']}: {e}")
+        await finish_order(order["_id"], bought)
+
+        target_display = get_target_display_local(order["target_user_id"], order["target_chat_id"], owner_id)
+        text = purchase_result_text(order["gift_display"], bought, order["quantity"], target_display)
+        message = await bot.send_message(chat_id=order["chat_id"], text=text)
+        await update_menu(
+            bot=bot, chat_id=order["chat_id"], user_id=owner_id, message_id=message.message_id
+        )
+
+
+def _get_owner_lock(owner_id: int) -> asyncio.Lock:
+    lock = _owner_locks.get(owner_id)
+    if lock is None:
+        lock = _owner_locks[owner_id] = asyncio.Lock()
+    return lock
+
+
+def _get_owner_slots() -> asyncio.Semaphore:
+    global _owner_slots
+    if _owner_slots is None:
+        _owner_slots = asyncio.Semaphore(ENGINE_MAX_CONCURRENT_OWNERS)
+    return _owner_slots
+
+
+async def start_owner(bot, owner_id: int) -> None:
+    """
+    Запускает воркер покупок владельца и его фоновые задачи (проверка юзербота, получатели).
+    Владелец с выключенными покупками (ACTIVE=False) подключается, только если у него есть заказы из каталога.
+    Повторный вызов для уже запущенного владельца ничего не делает.
+    """
+    async with _get_owner_lock(owner_id):
+        if owner_id in _owner_tasks:
+            return
+        config = await get_valid_config(owner_id)
+        if not config["ACTIVE"] and not await has_pending_orders(owner_id):
+            return
+        if _sharded and not await claim_owner(owner_id):
+            return  # Владельца обслуживает другой процесс
+        _owner_tasks[owner_id] = []
+
+        userbot_data = config.get("USERBOT", {})
+        if not is_userbot_active(owner_id) and all(userbot_data.get(k) for k in ("API_ID", "API_HASH", "PHONE")):
+            try:
+                await try_start_userbot_from_config(owner_id)
+                if is_userbot_active(owner_id):
+                    _engine_clients.add(owner_id)
+            except Exception as e:
+                logger.error(f"[{owner_id}] Не удалось запустить юзербот: {e}")
+
+        register_worker(owner_id)
+        _owner_tasks[owner_id] = [
+            asyncio.create_task(owner_worker(bot, owner_id)),
+            asyncio.create_task(userbot_supervisor(owner_id)),
+            asyncio.create_task(recipients_refresher(bot, owner_id)),
+        ]
+    logger.info(f"Движок покупок: владелец {owner_id} подключён (всего: {len(_owner_tasks)})")
+
+
+async def stop_owner(owner_id: int, release: bool = True) -> None:
+    """
+    Останавливает воркер и фоновые задачи владельца, юзербот (если его запустил движок)
+    и (по умолчанию) освобождает аренду. Может вызываться из самого воркера владельца.
+    """
+    async with _get_owner_lock(owner_id):
+        tasks = _owner_tasks.pop(owner_id, None)
+        if tasks is None:
+            return
+        unregister_worker(owner_id)
+        current = asyncio.current_task()
+        for task in tasks:
+            if task is not current:
+                task.cancel()
+        if owner_id in _engine_clients:
+            _engine_clients.discard(owner_id)
+            await stop_userbot(owner_id)
+        if release and _sharded:
+            await release_owner(owner_id)
+    logger.info(f"Движок покупок: владелец {owner_id} отключён")
+
+
+async def lease_heartbeat() -> None:
+    """
+    Фоновая задача: продлевает аренду владельцев и отключает тех, кого забрал другой процесс.
+    """
+    while True:
+        try:
+            for owner_id in await renew_leases():
+                await stop_owner(owner_id, release=False)
+        except Exception as e:
+            logger.error(f"Ошибка продления аренды владельцев: {e}")
+        await asyncio.sleep(LEASE_RENEW_INTERVAL)
+
+
+async def purchase_engine(bot, owner_ids=(), sharded: bool = False) -> None:
+    """
+    Движок покупок для многих владельцев в одном процессе.
+
+    - Владельцы owner_ids (например, администратор из TELEGRAM_USER_ID) подключаются при старте.
+    - Раз в ENGINE_DISCOVERY_INTERVAL секунд из MongoDB подгружаются владельцы с ACTIVE=True.
+    - Владельцы, для которых пришло событие (например, включили покупки), подключаются сразу.
+    - Подключаются только владельцы с ACTIVE=True; после выключения покупок владелец отключается.
+
+    При sharded=True владельцы делятся между несколькими процессами: процесс берёт владельца
+    только захватив его аренду (services.lease), продлевает её раз в LEASE_RENEW_INTERVAL секунд,
+    а владельцев упавшего процесса забирает после истечения LEASE_TTL. Владельцы owner_ids
+    в этом режиме захватываются на общих основаниях.
+    """
+    global _sharded
+    if sharded:
+        _sharded = True
+        set_config_cache_ttl(SHARDED_CONFIG_CACHE_TTL)
+        await ensure_lease_indexes()
+        asyncio.create_task(lease_heartbeat())
+        logger.info(f"Движок покупок запущен в режиме шардирования: {WORKER_ID}")
+
+    for owner_id in owner_ids:
+        await start_owner(bot, owner_id)
+
+    while True:
+        try:
+            owners = set(take_notified_owners())
+            owners.update(await get_active_owner_ids())
+            owners.update(await get_owners_with_orders())
+            for owner_id in owners - set(_owner_tasks):
+                try:
+                    await start_owner(bot, owner_id)
+                except Exception as e:
+                    _owner_tasks.pop(owner_id, None)
+                    logger.error(f"Движок покупок: не удалось подключить владельца {owner_id}: {e}")
+        except Exception as e:
+            logger.error(f"Ошибка движка покупок: {e}")
+        await wait_for_engine_wakeup(timeout=ENGINE_DISCOVERY_INTERVAL)